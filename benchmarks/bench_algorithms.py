@@ -0,0 +1,60 @@
+"""
+Sign/verify throughput and link length for each supported algorithm.
+
+    python benchmarks/bench_algorithms.py [--seconds S]
+"""
+import argparse
+import base64
+from datetime import datetime, timedelta
+import functools
+import secrets
+import time
+
+import jwt
+
+from jupyterhub_share_link.generate_keys import ALGORITHMS, generate_keys
+from jupyterhub_share_link.tokens import (algorithm_for_key, load_private_key,
+                                          load_public_key)
+
+
+def rate(func, seconds):
+    "Return how many times per second func can be called."
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        func()
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def main(seconds):
+    payload = {'user': 'alice', 'path': 'examples/array.ipynb',
+               'opts': {'image': 'jupyter/base-notebook:latest'},
+               'exp': datetime.utcnow() + timedelta(hours=1)}
+    secret = secrets.token_urlsafe(32).encode()
+    keys = [(secret, secret)]
+    for algorithm in ALGORITHMS:
+        private_pem, public_pem = generate_keys(algorithm)
+        keys.append((load_private_key(private_pem),
+                     load_public_key(public_pem)))
+    print(f'{"algorithm":>9} {"sign/s":>9} {"verify/s":>9} {"link chars":>10}')
+    for private_key, public_key in keys:
+        algorithm = algorithm_for_key(private_key)
+        token = jwt.encode(payload, private_key, algorithm=algorithm)
+        if isinstance(token, str):
+            token = token.encode('ascii')
+        link_token = base64.urlsafe_b64encode(token)
+        signs = rate(functools.partial(jwt.encode, payload, private_key,
+                                       algorithm=algorithm), seconds)
+        verifies = rate(functools.partial(jwt.decode, token, public_key,
+                                          algorithms=[algorithm]), seconds)
+        print(f'{algorithm:>9} {signs:9.0f} {verifies:9.0f} '
+              f'{len(link_token):10d}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=1.0,
+                        help="time to spend measuring each operation")
+    args = parser.parse_args()
+    main(args.seconds)
@@ -0,0 +1,227 @@
+"""
+Create and open links end to end, against a stand-in Hub and user servers.
+
+For each scenario, start the service as it is deployed (python -m
+jupyterhub_share_link.run) pointed at a MockHub, create one link per
+recipient, and have every recipient open theirs. Report latency percentiles,
+throughput and the service's peak resident memory.
+
+    small  a small file, opened into servers that are already running
+    large  a large file, opened into servers that are already running
+    cold   a small file, opened by recipients whose servers must be spawned
+
+    python benchmarks/bench_end_to_end.py [--scenario small] [--opens N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from jupyterhub_share_link.generate_keys import generate_keys
+from mocks import MockHub, size_in_bytes
+
+
+PREFIX = '/services/share-link/'
+REPO = pathlib.Path(__file__).resolve().parent.parent
+
+
+def percentile(sorted_values, q):
+    "Return the q-th percentile (0-100) of sorted values, by nearest rank."
+    if not sorted_values:
+        return float('nan')
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def peak_rss(pid):
+    "Return the peak resident memory of a process in bytes, if known."
+    try:
+        status = pathlib.Path(f'/proc/{pid}/status').read_text()
+    except OSError:
+        return None
+    for line in status.splitlines():
+        if line.startswith('VmHWM:'):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_service(directory, hub_port, service_port, algorithm, verbose):
+    private_pem, public_pem = generate_keys(algorithm)
+    (directory / 'private.pem').write_bytes(private_pem)
+    (directory / 'public.pem').write_bytes(public_pem)
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(
+            filter(None, [str(REPO), os.getenv('PYTHONPATH')])),
+        JUPYTERHUB_API_TOKEN='service-token',
+        JUPYTERHUB_API_URL=f'http://127.0.0.1:{hub_port}/hub/api',
+        JUPYTERHUB_SERVICE_NAME='share-link',
+        JUPYTERHUB_SERVICE_PREFIX=PREFIX,
+        JUPYTERHUB_SERVICE_URL=f'http://127.0.0.1:{service_port}',
+    )
+    output = None if verbose else subprocess.DEVNULL
+    return subprocess.Popen(
+        [sys.executable, '-m', 'jupyterhub_share_link.run'],
+        cwd=directory, env=env, stdout=output, stderr=output)
+
+
+async def wait_until_up(client, url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError("The service exited during startup.")
+        try:
+            await client.fetch(url)
+            return
+        except OSError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError("The service did not start.")
+        await asyncio.sleep(0.1)
+
+
+async def run_all(fn, count, concurrency):
+    """
+    Call fn(i) for i in range(count), at most concurrency at once.
+
+    Return the sorted latencies of the calls that succeeded, the number that
+    failed, and the wall-clock time taken.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = []
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await fn(i)
+            except Exception as e:
+                errors.append(e)
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    elapsed = time.perf_counter() - started
+    if errors:
+        print(f"  {len(errors)} failed, e.g. {errors[0]!r}", file=sys.stderr)
+    return sorted(latencies), len(errors), elapsed
+
+
+async def scenario(name, path, size, recipients, warm, args):
+    hub = MockHub(spawn_latency=args.spawn_latency, files={path: size})
+    hub.add_server('alice')
+    for i in range(recipients):
+        if warm:
+            hub.add_server(f'student{i}', 'warm')
+        else:
+            hub.user(f'student{i}')
+    sock, hub_port = bind_unused_port()
+    hub_server = HTTPServer(hub.app(), max_body_size=4 * size + 1024 ** 2)
+    hub_server.add_sockets([sock])
+    service_port = unused_port()
+    service_url = f'http://127.0.0.1:{service_port}{PREFIX}'
+    # The service reaches user servers through the host that requests to it
+    # came in on, as it would through the Hub's proxy.
+    proxy_host = f'127.0.0.1:{hub_port}'
+    client = AsyncHTTPClient(force_instance=True,
+                             max_clients=args.concurrency)
+
+    with tempfile.TemporaryDirectory() as directory:
+        process = start_service(pathlib.Path(directory), hub_port,
+                                service_port, args.algorithm, args.verbose)
+        try:
+            await wait_until_up(client, service_url, process)
+            links = [None] * recipients
+
+            async def create(i):
+                resp = await client.fetch(HTTPRequest(
+                    service_url + 'create', method='POST',
+                    headers={'Authorization': 'token user-alice',
+                             'Host': proxy_host},
+                    body=json.dumps({'path': path, 'base_url': '/user/alice/'}),
+                    request_timeout=600))
+                links[i] = json.loads(resp.body)['link']
+
+            async def open_link(i):
+                query = links[i].split('?', 1)[1]
+                resp = await client.fetch(HTTPRequest(
+                    f'{service_url}open?{query}',
+                    headers={'Authorization': f'token user-student{i}',
+                             'Host': proxy_host},
+                    follow_redirects=False, request_timeout=600),
+                    raise_error=False)
+                if resp.code != 302:
+                    raise RuntimeError(f"open returned {resp.code}")
+
+            results = [('create', *await run_all(create, recipients,
+                                                 args.concurrency))]
+            results.append(('open', *await run_all(open_link, recipients,
+                                                   args.concurrency)))
+            rss = peak_rss(process.pid)
+        finally:
+            process.terminate()
+            process.wait()
+            client.close()
+            hub_server.stop()
+
+    for operation, latencies, errors, elapsed in results:
+        row = [f'{name:>6} {operation:>6} {len(latencies):6d} {errors:6d}']
+        row += [f'{1000 * percentile(latencies, q):9.1f}'
+                for q in (50, 95, 99)]
+        row.append(f'{len(latencies) / elapsed:9.1f}')
+        row.append(f'{rss / 1024 ** 2:8.0f}' if rss else f'{"?":>8}')
+        print(' '.join(row))
+    print(f'{"":>6} {"hub":>6} spawns {hub.stats["spawns"]}, user lookups '
+          f'{hub.stats["user_lookups"]}, bytes written '
+          f'{hub.stats["bytes_written"]}')
+
+
+async def main(args):
+    scenarios = {
+        'small': ('small.txt', args.small_size, args.opens, True),
+        'large': ('large.bin', args.large_size, args.large_opens, True),
+        'cold': ('small.txt', args.small_size, args.opens, False),
+    }
+    names = list(scenarios) if args.scenario == 'all' else [args.scenario]
+    print(f'{"":>6} {"":>6} {"ok":>6} {"errors":>6} {"p50 ms":>9} '
+          f'{"p95 ms":>9} {"p99 ms":>9} {"per s":>9} {"RSS MB":>8}')
+    for name in names:
+        await scenario(name, *scenarios[name], args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scenario', default='all',
+                        choices=['all', 'small', 'large', 'cold'])
+    parser.add_argument('--opens', type=int, default=200,
+                        help="recipients in the small and cold scenarios")
+    parser.add_argument('--large-opens', type=int, default=10,
+                        help="recipients in the large scenario")
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--small-size', type=size_in_bytes, default='10k')
+    parser.add_argument('--large-size', type=size_in_bytes, default='32M')
+    parser.add_argument('--spawn-latency', type=float, default=1.0,
+                        help="seconds the stand-in Hub takes to spawn")
+    parser.add_argument('--algorithm', default='RS256',
+                        help="algorithm of the keys the service signs with")
+    parser.add_argument('--verbose', action='store_true',
+                        help="show the service's log")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,87 @@
+"""
+Event-loop latency during a storm of token signing.
+
+Compare signing share tokens directly on the event loop, from PEM text and
+from a parsed key object, with handing the work to TokenSigner's thread
+pool. A ticker coroutine measures how late the
+loop is to wake it while the storm runs.
+
+    python benchmarks/bench_signing.py [--tokens N] [--threads N]
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+import statistics
+import time
+
+import jwt
+
+from jupyterhub_share_link.generate_keys import generate_keys
+from jupyterhub_share_link.tokens import (TokenSigner, load_private_key,
+                                          load_public_key)
+
+
+async def measure_lag(storm, interval=0.001):
+    "Run storm() while sampling event-loop lag; return (seconds, lags)."
+    lags = []
+    done = False
+
+    async def ticker():
+        while not done:
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            lags.append(max(0, time.perf_counter() - expected))
+
+    tick = asyncio.ensure_future(ticker())
+    started = time.perf_counter()
+    await storm()
+    elapsed = time.perf_counter() - started
+    done = True
+    await tick
+    return elapsed, lags
+
+
+def report(name, count, elapsed, lags):
+    lags = sorted(lags) or [0]
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+    print(f'{name:>12}: {count / elapsed:8.0f} tokens/s  '
+          f'loop lag median {statistics.median(lags) * 1e3:6.2f} ms  '
+          f'p99 {p99 * 1e3:6.2f} ms  max {lags[-1] * 1e3:6.2f} ms')
+
+
+async def main(tokens, threads):
+    private_pem, public_pem = generate_keys()
+    payload = {'user': 'alice', 'path': 'a.ipynb', 'opts': {},
+               'exp': datetime.utcnow() + timedelta(hours=1)}
+
+    async def inline_storm():
+        for _ in range(tokens):
+            jwt.encode(payload, private_pem, algorithm='RS256')
+            # Yield as a request handler would between requests.
+            await asyncio.sleep(0)
+
+    private_key = load_private_key(private_pem)
+
+    async def inline_key_storm():
+        for _ in range(tokens):
+            jwt.encode(payload, private_key, algorithm='RS256')
+            await asyncio.sleep(0)
+
+    TokenSigner.max_workers = threads
+    signer = TokenSigner(private_key, load_public_key(public_pem))
+
+    async def threaded_storm():
+        await asyncio.gather(*(signer.encode(payload)
+                               for _ in range(tokens)))
+
+    report('inline PEM', tokens, *await measure_lag(inline_storm))
+    report('inline key', tokens, *await measure_lag(inline_key_storm))
+    report('thread pool', tokens, *await measure_lag(threaded_storm))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--tokens', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main(args.tokens, args.threads))
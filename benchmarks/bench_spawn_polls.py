@@ -0,0 +1,72 @@
+"""
+Hub polls per spawn, and how late readiness is noticed, by poll schedule.
+
+Simulates spawns whose durations are drawn from a distribution, polling on
+the schedule of Launcher._poll_intervals. The fixed schedule is the one used
+without spawn history; the adaptive one learns from the spawns before.
+
+    python benchmarks/bench_spawn_polls.py [--spawns N] [--seed S]
+"""
+import argparse
+import random
+import statistics
+
+from jupyterhub_share_link.launcher import Launcher, SpawnTimes
+
+
+SCENARIOS = {
+    # A cached image on a warm node.
+    'steady': lambda rng: max(rng.gauss(15, 2), 1),
+    # Most spawns find the image cached; some pull it or wait for a node.
+    'bimodal': lambda rng: (rng.gauss(12, 2) if rng.random() < 0.7
+                            else rng.gauss(90, 15)),
+    # Long, variable spawns, as when nodes are autoscaled.
+    'slow': lambda rng: max(rng.lognormvariate(4.5, 0.3), 1),
+}
+
+
+def poll(launcher, user_options, duration):
+    "Return the number of polls until a spawn of duration is seen, and the lag."
+    elapsed = 0
+    polls = 0
+    for interval in launcher._poll_intervals(user_options):
+        polls += 1
+        if elapsed >= duration:
+            return polls, elapsed - duration
+        elapsed += interval
+
+
+def simulate(draw, spawns, history, seed):
+    rng = random.Random(seed)
+    launcher = Launcher({'name': 'alice'}, 'secret')
+    launcher.spawn_times = SpawnTimes(size=history)
+    user_options = {'image': 'a'}
+    polls, lags = [], []
+    for _ in range(spawns):
+        duration = draw(rng)
+        count, lag = poll(launcher, user_options, duration)
+        polls.append(count)
+        lags.append(lag)
+        launcher.spawn_times.record(user_options, duration)
+    return polls, lags
+
+
+def main(spawns, seed):
+    print(f'{"scenario":>8} {"schedule":>8} {"polls":>6} {"lag p50":>8} '
+          f'{"lag p95":>8}')
+    for name, draw in SCENARIOS.items():
+        for schedule, history in (('fixed', 0), ('adaptive', 50)):
+            polls, lags = simulate(draw, spawns, history, seed)
+            lags.sort()
+            print(f'{name:>8} {schedule:>8} {statistics.mean(polls):6.1f} '
+                  f'{lags[len(lags) // 2]:8.2f} '
+                  f'{lags[int(len(lags) * 0.95)]:8.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--spawns', type=int, default=1000,
+                        help="spawns to simulate for each schedule")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    main(args.spawns, args.seed)
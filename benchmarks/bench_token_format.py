@@ -0,0 +1,74 @@
+"""
+Link length and decode time of the legacy and compact token formats.
+
+The legacy format is a JWT, base64-encoded again; the compact format is a
+JWS of the claims, deflate-compressed. Plain user_options are those of a
+single image; rich ones imitate a profile form with many fields.
+
+    python benchmarks/bench_token_format.py [--seconds S]
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+import functools
+import time
+
+from jupyterhub_share_link.generate_keys import generate_keys
+from jupyterhub_share_link.tokens import (TokenSigner, load_private_key,
+                                          load_public_key)
+
+
+PLAIN = {'image': 'jupyter/base-notebook:latest'}
+RICH = {
+    'profile': 'gpu-large',
+    'image': 'registry.example.org/research/pytorch-notebook:2024.10.1',
+    'cpu_limit': 8, 'cpu_guarantee': 4,
+    'mem_limit': '64G', 'mem_guarantee': '32G',
+    'extra_resource_limits': {'nvidia.com/gpu': 1},
+    'node_selector': {'cloud.google.com/gke-accelerator': 'nvidia-tesla-t4'},
+    'volumes': [{'name': f'project-{i}',
+                 'persistentVolumeClaim': {'claimName': f'project-{i}-pvc'}}
+                for i in range(6)],
+    'volume_mounts': [{'name': f'project-{i}',
+                       'mountPath': f'/home/jovyan/projects/project-{i}'}
+                      for i in range(6)],
+    'environment': {f'SETTING_{i}': f'value-{i}' for i in range(12)},
+}
+
+
+async def time_per_call(func, seconds):
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        await func()
+        count += 1
+    return (time.perf_counter() - started) / count
+
+
+async def main(seconds):
+    TokenSigner.max_workers = 1
+    print(f'{"algorithm":>9} {"options":>7} {"format":>7} {"chars":>6} '
+          f'{"decode us":>9}')
+    for algorithm in ('RS256', 'EdDSA'):
+        private_pem, public_pem = generate_keys(algorithm)
+        signer = TokenSigner(load_private_key(private_pem),
+                             load_public_key(public_pem))
+        for name, opts in (('plain', PLAIN), ('rich', RICH)):
+            payload = {'user': 'alice', 'path': 'analysis/results.ipynb',
+                       'opts': opts,
+                       'exp': datetime.utcnow() + timedelta(hours=1)}
+            for link_format in ('legacy', 'compact'):
+                signer.link_format = link_format
+                token = await signer.encode_link(payload)
+                per_call = await time_per_call(
+                    functools.partial(signer.decode_link, token), seconds)
+                print(f'{algorithm:>9} {name:>7} {link_format:>7} '
+                      f'{len(token):6d} {per_call * 1e6:9.0f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=1.0,
+                        help="time to spend decoding each token")
+    args = parser.parse_args()
+    asyncio.run(main(args.seconds))
@@ -0,0 +1,221 @@
+"""
+Local stand-ins for JupyterHub and for users' Jupyter servers.
+
+MockHub serves the parts of the Hub API that the service uses, and spawns
+servers after a configurable delay. It also serves the contents API of every
+server it has spawned, from files of configurable sizes, so that one port
+plays the part of the Hub's proxy: the service reaches user servers through
+the host its own requests came in on.
+"""
+import asyncio
+import base64
+from datetime import datetime, timezone
+import json
+import re
+
+from tornado.web import Application, HTTPError, RequestHandler
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class MockHub():
+    """
+    The state of the stand-in Hub: users, their servers, and shared files.
+
+    Users are created on first use. A request authenticated with the token
+    'user-<name>' is from that user; any other token is the service's.
+    files maps paths to sizes in bytes; every server has the same files.
+    """
+
+    def __init__(self, spawn_latency=0, page_size=50,
+                 service_name='share-link', files=None):
+        self.spawn_latency = spawn_latency
+        self.page_size = page_size
+        self.service_name = service_name
+        self.files = dict(files or {})
+        self.users = {}  # name -> user model
+        self.spawned = {}  # (user, server name) -> Event set when ready
+        self.stats = {'spawns': 0, 'user_lookups': 0, 'bytes_written': 0}
+        self._content = {}  # size -> bytes
+
+    def user(self, name):
+        if name not in self.users:
+            self.users[name] = {'kind': 'user', 'name': name, 'admin': False,
+                                'servers': {}}
+        return self.users[name]
+
+    def add_server(self, username, server_name='', user_options=None):
+        "Add a server that is already running."
+        server = self._server(username, server_name, user_options or {})
+        server.update(ready=True, pending=None)
+        return server
+
+    def _server(self, username, server_name, user_options):
+        server = {'name': server_name,
+                  'url': f'/user/{username}/{server_name}',
+                  'ready': False,
+                  'pending': 'spawn',
+                  'user_options': user_options,
+                  'last_activity': _now()}
+        if not server['url'].endswith('/'):
+            server['url'] += '/'
+        self.user(username)['servers'][server_name] = server
+        return server
+
+    def spawn(self, username, server_name, user_options):
+        "Start spawning a server; it becomes ready after spawn_latency."
+        self.stats['spawns'] += 1
+        server = self._server(username, server_name, user_options)
+        ready = self.spawned[(username, server_name)] = asyncio.Event()
+
+        def finish():
+            server.update(ready=True, pending=None)
+            ready.set()
+
+        asyncio.get_running_loop().call_later(self.spawn_latency, finish)
+        return server
+
+    def content(self, size):
+        "Return size bytes of file content."
+        if size not in self._content:
+            block = bytes(range(256)) * 4096
+            self._content[size] = (block * (size // len(block) + 1))[:size]
+        return self._content[size]
+
+    def app(self, **settings):
+        prefix = r'/user/(?P<user>[^/]+)/(?P<server>[^/]*)/?'
+        return Application([
+            (r'/hub/api/user', CurrentUser),
+            (r'/hub/api/users', Users),
+            (r'/hub/api/users/([^/]+)', User),
+            (r'/hub/api/users/([^/]+)/servers/([^/]*)/progress', Progress),
+            (r'/hub/api/users/([^/]+)/servers/([^/]*)', Server),
+            (prefix + r'api/contents/(?P<path>.*)', Contents),
+            (prefix + r'files/(?P<path>.*)', Files),
+        ], hub=self, **settings)
+
+
+class HubHandler(RequestHandler):
+
+    @property
+    def hub(self):
+        return self.settings['hub']
+
+    def token(self):
+        header = self.request.headers.get('Authorization', '')
+        return header.split(' ', 1)[-1]
+
+    def server_or_404(self, username, server_name):
+        servers = self.hub.user(username)['servers']
+        if server_name not in servers:
+            raise HTTPError(404)
+        return servers[server_name]
+
+
+class CurrentUser(HubHandler):
+    def get(self):
+        token = self.token()
+        if not token.startswith('user-'):
+            raise HTTPError(403)
+        model = dict(self.hub.user(token[len('user-'):]))
+        model['scopes'] = [f'access:services!service={self.hub.service_name}']
+        self.write(model)
+
+
+class Users(HubHandler):
+    def get(self):
+        offset = int(self.get_argument('offset', 0))
+        limit = min(int(self.get_argument('limit', self.hub.page_size)),
+                    self.hub.page_size)
+        names = sorted(self.hub.users)
+        items = [self.hub.users[name] for name in names[offset:offset + limit]]
+        accept = self.request.headers.get('Accept', '')
+        if 'application/jupyterhub-pagination+json' not in accept:
+            self.set_header('Content-Type', 'application/json')
+            self.write(json.dumps(items))
+            return
+        next_page = None
+        if offset + limit < len(names):
+            next_page = {'offset': offset + limit, 'limit': limit}
+        self.write({'items': items,
+                    '_pagination': {'offset': offset, 'limit': limit,
+                                    'total': len(names), 'next': next_page}})
+
+
+class User(HubHandler):
+    def get(self, username):
+        self.hub.stats['user_lookups'] += 1
+        self.write(self.hub.user(username))
+
+
+class Server(HubHandler):
+    def post(self, username, server_name):
+        servers = self.hub.user(username)['servers']
+        if server_name in servers:
+            raise HTTPError(400, "Server already exists")
+        user_options = json.loads(self.request.body or b'{}')
+        # The launcher adds a random token; it is not an option of the server.
+        user_options.pop('token', None)
+        self.hub.spawn(username, server_name, user_options)
+        self.set_status(202)
+
+    def delete(self, username, server_name):
+        self.server_or_404(username, server_name)
+        del self.hub.user(username)['servers'][server_name]
+        self.set_status(204)
+
+
+class Progress(HubHandler):
+    async def get(self, username, server_name):
+        server = self.server_or_404(username, server_name)
+        self.set_header('Content-Type', 'text/event-stream')
+        ready = self.hub.spawned.get((username, server_name))
+        if ready is not None:
+            await ready.wait()
+        event = {'progress': 100, 'ready': True, 'url': server['url'],
+                 'message': "Server ready"}
+        self.write(f'data: {json.dumps(event)}\n\n')
+
+
+class Contents(HubHandler):
+    def get(self, user, server, path):
+        size = self.hub.files.get(path)
+        if size is None:
+            raise HTTPError(404)
+        model = {'name': path.rsplit('/', 1)[-1], 'path': path,
+                 'type': 'file', 'mimetype': None, 'writable': True,
+                 'created': _now(), 'last_modified': _now(),
+                 'size': size, 'format': None, 'content': None}
+        if self.get_argument('content', '1') != '0':
+            model['format'] = 'base64'
+            model['content'] = base64.b64encode(
+                self.hub.content(size)).decode('ascii')
+        self.write(model)
+
+    def put(self, user, server, path):
+        # Decoding the base64 content would only slow the stand-in down;
+        # count what arrived instead.
+        self.hub.stats['bytes_written'] += len(self.request.body)
+        self.set_status(201)
+        self.write({'name': path.rsplit('/', 1)[-1], 'path': path,
+                    'type': 'file'})
+
+
+class Files(HubHandler):
+    def get(self, user, server, path):
+        size = self.hub.files.get(path)
+        if size is None:
+            raise HTTPError(404)
+        self.set_header('Content-Type', 'application/octet-stream')
+        self.write(self.hub.content(size))
+
+
+def size_in_bytes(text):
+    "Parse a size such as '10k', '32M' or '1G' into bytes."
+    match = re.fullmatch(r'(\d+)([kKmMgG]?)', text)
+    if match is None:
+        raise ValueError(f"Not a size: {text!r}")
+    number, unit = match.groups()
+    return int(number) * 1024 ** ' kmg'.index(unit.lower() or ' ')
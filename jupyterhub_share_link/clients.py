@@ -0,0 +1,173 @@
+"""
+The HTTP client shared by all requests to the Hub and to user servers.
+
+Requests go through one AsyncHTTPClient per IOLoop, using curl_httpclient when
+pycurl is installed, because it keeps connections to the Hub and the proxy
+alive between requests; tornado's simple client opens a connection for each.
+Requests that stream their body from a body_producer, which curl_httpclient
+does not support, use a simple client instead. On top of the client's own
+limit on concurrent requests, each destination (host and port) may be limited
+separately, so that a burst of copies through the proxy cannot starve
+requests to the Hub API.
+"""
+import asyncio
+from collections import Counter
+import os
+import time
+from urllib.parse import urlsplit
+import weakref
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+
+from . import metrics
+
+
+def _curl_available():
+    try:
+        import pycurl  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class HTTPClientPool():
+    """
+    Limit and measure the requests made through the shared AsyncHTTPClient.
+    """
+
+    implementation = os.getenv('JUPYTERHUB_SHARE_LINK_HTTP_CLIENT', 'auto')
+    max_clients = int(os.getenv('JUPYTERHUB_SHARE_LINK_HTTP_MAX_CLIENTS', 100))
+    max_per_host = int(os.getenv('JUPYTERHUB_SHARE_LINK_HTTP_MAX_PER_HOST',
+                                 0))
+    # Tornado caps response bodies at 100 MB by default, even when streaming.
+    max_body_size = int(os.getenv(
+        'JUPYTERHUB_SHARE_LINK_TRANSFER_MAX_BODY_SIZE', 64 * 1024 ** 3))
+
+    _configured = None
+    _instances = weakref.WeakKeyDictionary()  # event loop -> HTTPClientPool
+
+    @classmethod
+    def configure(cls):
+        """
+        Configure AsyncHTTPClient for the whole process. Return the name of
+        the implementation in use.
+        """
+        if cls._configured is None:
+            implementation = cls.implementation
+            if implementation == 'auto':
+                implementation = 'curl' if _curl_available() else 'simple'
+            if implementation == 'curl':
+                AsyncHTTPClient.configure(
+                    'tornado.curl_httpclient.CurlAsyncHTTPClient',
+                    max_clients=cls.max_clients,
+                    max_body_size=cls.max_body_size)
+                cls._configured = 'curl'
+            else:
+                AsyncHTTPClient.configure(
+                    None, max_clients=cls.max_clients,
+                    max_body_size=cls.max_body_size)
+                cls._configured = 'simple'
+        return cls._configured
+
+    @classmethod
+    def instance(cls):
+        "Return the pool for the running event loop."
+        loop = asyncio.get_running_loop()
+        pool = cls._instances.get(loop)
+        if pool is None:
+            pool = cls._instances[loop] = cls()
+        return pool
+
+    def __init__(self):
+        implementation = self.configure()
+        self.client = AsyncHTTPClient()
+        if implementation == 'curl':
+            # curl_httpclient cannot stream a request body from a
+            # body_producer, so those requests use a simple client.
+            self.streaming_client = SimpleAsyncHTTPClient(
+                force_instance=True, max_clients=self.max_clients,
+                max_body_size=self.max_body_size)
+        else:
+            self.streaming_client = self.client
+        self._total = asyncio.Semaphore(self.max_clients)
+        self._hosts = {}  # host -> Semaphore
+        self.active = 0
+        self.waiting = Counter()  # host -> requests waiting for a slot
+        self.requests = 0
+        self.wait_time_total = 0
+        self.wait_time_max = 0
+
+    def _host_limit(self, host):
+        if self.max_per_host <= 0:
+            return None
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = self._hosts[host] = asyncio.Semaphore(
+                self.max_per_host)
+        return semaphore
+
+    async def fetch(self, request, limit=True):
+        """
+        Fetch request with the shared client.
+
+        Pass limit=False for long-lived requests that mostly sit idle, such
+        as event streams, so that they do not hold a slot.
+        """
+        client = self.client
+        if request.body_producer is not None:
+            client = self.streaming_client
+        if not limit:
+            return await client.fetch(request)
+        host = urlsplit(request.url).netloc
+        host_limit = self._host_limit(host)
+        started = time.monotonic()
+        self.waiting[host] += 1
+        queued = metrics.HTTP_CLIENT_QUEUED.labels(host)
+        queued.inc()
+        try:
+            if host_limit is not None:
+                await host_limit.acquire()
+            try:
+                await self._total.acquire()
+            except BaseException:
+                if host_limit is not None:
+                    host_limit.release()
+                raise
+        finally:
+            queued.dec()
+            self.waiting[host] -= 1
+            if not self.waiting[host]:
+                del self.waiting[host]
+        waited = time.monotonic() - started
+        metrics.HTTP_CLIENT_WAIT_DURATION.observe(waited)
+        self.requests += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+        self.active += 1
+        metrics.HTTP_CLIENT_ACTIVE.inc()
+        try:
+            return await client.fetch(request)
+        finally:
+            metrics.HTTP_CLIENT_ACTIVE.dec()
+            self.active -= 1
+            self._total.release()
+            if host_limit is not None:
+                host_limit.release()
+
+    def status(self):
+        "Return a summary of the pool for reporting."
+        return {'implementation': self._configured,
+                'max_clients': self.max_clients,
+                'max_per_host': self.max_per_host,
+                'active': self.active,
+                'queued': sum(self.waiting.values()),
+                'queued_by_host': dict(self.waiting),
+                'requests': self.requests,
+                'wait_time_total': self.wait_time_total,
+                'wait_time_max': self.wait_time_max}
+
+
+async def fetch(request, limit=True):
+    "Fetch request through the HTTPClientPool of the running event loop."
+    return await HTTPClientPool.instance().fetch(request, limit=limit)
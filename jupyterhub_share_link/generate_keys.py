@@ -1,17 +1,39 @@
+import argparse
+
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+
+ALGORITHMS = ('RS256', 'ES256', 'EdDSA')
 
 
-def generate_keys():
+def generate_keys(algorithm='RS256'):
     """
     Generate private key and public key serialized bytes.
+
+    algorithm is the JWT algorithm the keys are for: 'RS256' (RSA-2048),
+    'ES256' (ECDSA on P-256) or 'EdDSA' (Ed25519).
     """
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=2048,
-        backend=default_backend()
-    )
+    if algorithm == 'RS256':
+        private_key = rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=2048,
+            backend=default_backend()
+        )
+        private_format = serialization.PrivateFormat.TraditionalOpenSSL
+    elif algorithm == 'ES256':
+        private_key = ec.generate_private_key(
+            ec.SECP256R1(),
+            backend=default_backend()
+        )
+        private_format = serialization.PrivateFormat.PKCS8
+    elif algorithm == 'EdDSA':
+        private_key = ed25519.Ed25519PrivateKey.generate()
+        private_format = serialization.PrivateFormat.PKCS8
+    else:
+        raise ValueError(f"algorithm must be one of {ALGORITHMS}, "
+                         f"not {algorithm!r}")
     public_key = private_key.public_key()
     public_pem = public_key.public_bytes(
         encoding=serialization.Encoding.PEM,
@@ -19,7 +41,7 @@ def generate_keys():
     )
     private_pem = private_key.private_bytes(
         encoding=serialization.Encoding.PEM,
-        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        format=private_format,
         encryption_algorithm=serialization.NoEncryption()
     )
     return private_pem, public_pem
@@ -27,7 +49,11 @@ def generate_keys():
 
 def main():
     "Write private.pem and public.pem in the current directory."
-    private_pem, public_pem = generate_keys()
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--algorithm', choices=ALGORITHMS, default='RS256',
+                        help="the algorithm links will be signed with")
+    args = parser.parse_args()
+    private_pem, public_pem = generate_keys(args.algorithm)
     with open('private.pem', 'wb') as file:
         file.write(private_pem)
     with open('public.pem', 'wb') as file:
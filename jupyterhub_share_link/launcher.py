@@ -5,39 +5,445 @@ This file has been vendored from the Python package binderhub. It has been
 vendored rather than imported because binderhub has many other dependencies not
 needed by this hub service.
 """
+import asyncio
 import base64
+from collections import OrderedDict, deque
+import contextlib
 import json
+import math
+import random
+import time
 import uuid
 import os
 
 from tornado.log import app_log
 from tornado import web, gen
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
+from tornado.httpclient import HTTPRequest, HTTPError
+
+from .clients import fetch
+from . import metrics
+from .tracing import span
+
+
+def canonical_options(user_options):
+    "Return a hashable key that is equal for equal user_options."
+    return json.dumps(user_options, sort_keys=True, separators=(',', ':'))
+
+
+class UserModelCache():
+    """
+    Short-lived LRU cache of Hub user models, shared within the process.
+
+    Concurrent lookups of the same user while a fetch is in flight wait on
+    that one fetch instead of issuing their own request to the Hub.
+    Callers must treat returned models as read-only.
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (expires, user model)
+        self._pending = {}  # key -> Future for an in-flight fetch
+
+    async def get(self, key, fetch, fresh=False):
+        """
+        Return the user model for key, calling fetch() on a miss.
+
+        If fresh is True, a cached model is not accepted, but an in-flight
+        fetch is still shared.
+        """
+        if not fresh:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, model = entry
+                if time.monotonic() < expires:
+                    self._entries.move_to_end(key)
+                    return model
+                del self._entries[key]
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._fill(key, fetch))
+            self._pending[key] = future
+        # Shield the shared fetch so that one cancelled waiter does not
+        # cancel it for everyone else.
+        return await asyncio.shield(future)
+
+    async def _fill(self, key, fetch):
+        task = asyncio.current_task()
+        try:
+            model = await fetch()
+        except BaseException:
+            if self._pending.get(key) is task:
+                del self._pending[key]
+            raise
+        # If the key was invalidated while we were fetching, this result may
+        # predate the change: hand it to our waiters but do not cache it.
+        if self._pending.get(key) is task:
+            del self._pending[key]
+            self._entries[key] = (time.monotonic() + self.ttl, model)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return model
+
+    def invalidate(self, key):
+        "Drop any cached model for key and detach any in-flight fetch."
+        self._entries.pop(key, None)
+        self._pending.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._pending.clear()
+
+
+class SpawnTimes():
+    """
+    Durations of recent successful spawns, by canonical user_options.
+
+    The last size durations are kept for each of the max_options options
+    spawned most recently. Once there are min_samples of them, they give an
+    estimate of how long the next spawn with those options will take.
+    """
+
+    def __init__(self, size, max_options=256, min_samples=5):
+        self.size = size
+        self.max_options = max_options
+        self.min_samples = min_samples
+        self._durations = OrderedDict()  # options key -> deque of seconds
+
+    def record(self, user_options, duration):
+        "Note that a server with user_options took duration seconds to start."
+        if self.size <= 0:
+            return
+        key = canonical_options(user_options)
+        durations = self._durations.get(key)
+        if durations is None:
+            durations = self._durations[key] = deque(maxlen=self.size)
+        durations.append(duration)
+        self._durations.move_to_end(key)
+        while len(self._durations) > self.max_options:
+            self._durations.popitem(last=False)
+
+    def percentiles(self, user_options, ps):
+        """
+        Return the given percentiles of the durations of spawns with
+        user_options, or None if too few have been seen.
+        """
+        return self._percentiles(
+            self._durations.get(canonical_options(user_options)), ps)
+
+    def _percentiles(self, durations, ps):
+        if durations is None or len(durations) < self.min_samples:
+            return None
+        ordered = sorted(durations)
+        return [ordered[max(math.ceil(p / 100 * len(ordered)), 1) - 1]
+                for p in ps]
+
+    def estimate(self, user_options):
+        """
+        Return the 10th, 50th and 90th percentile durations of spawns with
+        user_options, or None if too few have been seen.
+        """
+        return self._estimate(self._durations.get(
+            canonical_options(user_options)))
+
+    def _estimate(self, durations):
+        percentiles = self._percentiles(durations, (10, 50, 90))
+        if percentiles is None:
+            return None
+        return {'samples': len(durations),
+                **dict(zip(('p10', 'p50', 'p90'), percentiles))}
+
+    def estimates(self):
+        "Return the estimates for each canonical user_options."
+        estimates = {}
+        for key, durations in self._durations.items():
+            estimate = self._estimate(durations)
+            if estimate is not None:
+                estimates[key] = estimate
+        return estimates
+
+    def status(self):
+        """
+        Return a summary for reporting, without the user_options, which
+        GET / would otherwise show to anyone.
+        """
+        return {'options': len(self._durations),
+                'estimated': len(self.estimates()),
+                'samples': sum(map(len, self._durations.values()))}
+
+    def clear(self):
+        self._durations.clear()
+
+
+class RetryPolicy():
+    """
+    How often, and for how long, to retry a failed request to the Hub API.
+
+    At most attempts attempts are made, none starting more than budget
+    seconds after the first. The delays between them are "decorrelated
+    jitter": each is drawn at random between base_delay and three times the
+    previous delay, and capped at max_delay, so that requests that failed
+    together during an outage do not all retry together when it ends.
+    """
+
+    def __init__(self, attempts, budget, base_delay=0.25, max_delay=5):
+        self.attempts = attempts
+        self.budget = budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delays(self):
+        "Yield the successive delays between attempts."
+        delay = self.base_delay
+        while True:
+            delay = min(self.max_delay,
+                        random.uniform(self.base_delay, delay * 3))
+            yield delay
+
+
+class HubUnavailable(web.HTTPError):
+    "The Hub API is not being called because the circuit breaker is open."
+
+    def __init__(self, retry_after):
+        super().__init__(
+            503, "The Hub is unavailable. Try again in %d seconds.",
+            retry_after)
+        # Seconds until the Hub API will next be tried.
+        self.retry_after = retry_after
+
+
+class CircuitBreaker():
+    """
+    Stop calling the Hub API while it is failing.
+
+    The breaker is closed while the Hub is healthy. It opens when, over the
+    last window seconds, at least min_requests requests were made and a
+    fraction threshold or more of them failed with a 5xx error or a
+    connection error. While open, requests fail at once with HubUnavailable
+    rather than adding to the Hub's load as it recovers. After cooldown
+    seconds it is half-open: one request at a time is let through as a
+    probe, and the first to succeed closes the breaker again, while a
+    failure reopens it. A threshold of 0 disables the breaker.
+    """
+
+    threshold = float(os.getenv('JUPYTERHUB_SHARE_LINK_BREAKER_THRESHOLD',
+                                0.5))
+    min_requests = int(os.getenv('JUPYTERHUB_SHARE_LINK_BREAKER_MIN_REQUESTS',
+                                 10))
+    window = float(os.getenv('JUPYTERHUB_SHARE_LINK_BREAKER_WINDOW', 10))
+    cooldown = float(os.getenv('JUPYTERHUB_SHARE_LINK_BREAKER_COOLDOWN', 15))
+
+    _state_codes = {'closed': 0, 'half-open': 1, 'open': 2}
+
+    def __init__(self):
+        self._outcomes = deque()  # (time, failed) in the last window
+        self._failures = 0
+        self._state = 'closed'
+        self._opened_at = None
+        self._probing = False
+        self.stats = {'opened': 0, 'rejected': 0}
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    @property
+    def state(self):
+        "'closed', 'open' or 'half-open'."
+        if self._state == 'open':
+            if time.monotonic() >= self._opened_at + self.cooldown:
+                self._set_state('half-open')
+        return self._state
+
+    def _set_state(self, state):
+        self._state = state
+        metrics.HUB_CIRCUIT_STATE.set(self._state_codes[state])
+
+    def _retry_after(self):
+        if self._state == 'open':
+            time_left = self._opened_at + self.cooldown - time.monotonic()
+            return max(math.ceil(time_left), 1)
+        return 1
+
+    @contextlib.contextmanager
+    def guard(self):
+        """
+        Context manager around one request to the Hub API.
+
+        Raise HubUnavailable if the request should not be made; otherwise
+        record whether it succeeded.
+        """
+        if not self.enabled:
+            yield
+            return
+        state = self.state
+        if state == 'open' or (state == 'half-open' and self._probing):
+            self.stats['rejected'] += 1
+            metrics.HUB_CIRCUIT_REJECTED.inc()
+            raise HubUnavailable(self._retry_after())
+        probe = state == 'half-open'
+        if probe:
+            self._probing = True
+        try:
+            yield
+        except HTTPError as e:
+            self._record(failed=e.code >= 500, probe=probe)
+            raise
+        except OSError:
+            self._record(failed=True, probe=probe)
+            raise
+        except BaseException:
+            # Cancelled, or failed in some way that says nothing of the Hub.
+            if probe:
+                self._probing = False
+            raise
+        else:
+            self._record(failed=False, probe=probe)
+
+    def _record(self, failed, probe):
+        now = time.monotonic()
+        if probe:
+            self._probing = False
+        if self._state == 'half-open':
+            if failed:
+                self._open(now)
+            else:
+                self._outcomes.clear()
+                self._failures = 0
+                self._set_state('closed')
+                app_log.info("Hub API has recovered; closing the circuit")
+            return
+        self._outcomes.append((now, failed))
+        self._failures += failed
+        while self._outcomes[0][0] < now - self.window:
+            _, old_failed = self._outcomes.popleft()
+            self._failures -= old_failed
+        if self._state != 'closed' or len(self._outcomes) < self.min_requests:
+            return
+        if self._failures >= self.threshold * len(self._outcomes):
+            self._open(now)
+
+    def _open(self, now):
+        app_log.warning("Hub API is failing; not calling it for %ds",
+                        self.cooldown)
+        self._opened_at = now
+        self._set_state('open')
+        self.stats['opened'] += 1
+        metrics.HUB_CIRCUIT_OPENED.inc()
+
+    def status(self):
+        "Return a summary of the breaker for reporting."
+        state = self.state
+        return {'enabled': self.enabled,
+                'state': state,
+                'requests': len(self._outcomes),
+                'failures': self._failures,
+                'retry_after': self._retry_after() if state != 'closed' else None,
+                **self.stats}
 
 
 class Launcher():
 
-    retry_delay = 20
-    retries = 100
+    # Requests that only read from the Hub, or stop servers, are safe to
+    # retry; a spawn request is retried less, because the Hub may have acted
+    # on it. See RetryPolicy.
+    idempotent_retry = RetryPolicy(
+        attempts=int(os.getenv('JUPYTERHUB_SHARE_LINK_HUB_RETRY_ATTEMPTS', 5)),
+        budget=float(os.getenv('JUPYTERHUB_SHARE_LINK_HUB_RETRY_BUDGET', 15)),
+        max_delay=float(os.getenv('JUPYTERHUB_SHARE_LINK_HUB_RETRY_MAX_DELAY',
+                                  5)),
+    )
+    spawn_retry = RetryPolicy(
+        attempts=int(os.getenv('JUPYTERHUB_SHARE_LINK_SPAWN_RETRY_ATTEMPTS',
+                               3)),
+        budget=float(os.getenv('JUPYTERHUB_SHARE_LINK_SPAWN_RETRY_BUDGET', 30)),
+        base_delay=1,
+        max_delay=float(os.getenv('JUPYTERHUB_SHARE_LINK_HUB_RETRY_MAX_DELAY',
+                                  5)),
+    )
+    # Timeout of each request to the Hub API, if the request sets none.
+    request_timeout = 20
+    # Shared by every Launcher in the process. See CircuitBreaker.
+    breaker = CircuitBreaker()
     hub_url = "127.0.0.1:8000/"
+    # User models fetched from the Hub are shared by every Launcher in the
+    # process for a few seconds. See UserModelCache.
+    user_cache = UserModelCache(
+        ttl=float(os.getenv('JUPYTERHUB_SHARE_LINK_USER_CACHE_TTL', 5)),
+        max_size=int(os.getenv('JUPYTERHUB_SHARE_LINK_USER_CACHE_SIZE', 1024)),
+    )
+
+    # Launches in progress in this process, keyed by username and canonical
+    # user_options, so that concurrent requests for the same kind of server
+    # wait for one spawn instead of starting several.
+    pending_launches = {}
+
+    # How long to wait for a server to start, and how often to check on it
+    # when the Hub's progress event stream is unavailable. See
+    # _poll_intervals.
+    spawn_timeout = float(os.getenv('JUPYTERHUB_SHARE_LINK_SPAWN_TIMEOUT', 600))
+    poll_interval_min = 0.5
+    poll_interval_max = 5
+    poll_interval_sparse = 30
+    poll_backoff = 1.3
+    dense_polls = 10
+    # How long recent spawns took, shared by every Launcher in the process.
+    spawn_times = SpawnTimes(
+        size=int(os.getenv('JUPYTERHUB_SHARE_LINK_SPAWN_HISTORY', 50)))
 
-    def __init__(self, user, auth):
+    def __init__(self, user, auth, role='user', deadline=None):
         self.hub_api_token = auth
         self.user = user
+        # Why this server is wanted ('source', 'target' or 'pool'), for
+        # labelling metrics.
+        self.role = role
+        # The time.monotonic() by which the request being handled must be
+        # answered, if any. Retries and waits for spawns give up by then.
+        self.deadline = deadline
+
+    def _deadline(self, timeout, start=None):
+        """
+        Return the earlier of timeout seconds after start (by default, now)
+        and self.deadline.
+        """
+        if start is None:
+            start = time.monotonic()
+        deadline = start + timeout
+        if self.deadline is not None:
+            deadline = min(deadline, self.deadline)
+        return deadline
+
+    def hub_api_url(self, url):
+        "Return the full URL of an endpoint of the Hub API."
+        hub_api_url = os.getenv('JUPYTERHUB_API_URL', '') or self.hub_url + 'hub/api'
+        if not hub_api_url.endswith('/'):
+            hub_api_url = hub_api_url + '/'
+        return hub_api_url + url
 
     async def api_request(self, url, *args, **kwargs):
         """Make an API request to JupyterHub"""
         headers = kwargs.setdefault('headers', {})
         headers.update({'Authorization': 'token %s' % self.hub_api_token})
-        hub_api_url = os.getenv('JUPYTERHUB_API_URL', '') or self.hub_url + 'hub/api'
-        if not hub_api_url.endswith('/'):
-            hub_api_url = hub_api_url + '/'
-        request_url = hub_api_url + url
+        request_url = self.hub_api_url(url)
         req = HTTPRequest(request_url, *args, **kwargs)
-        retry_delay = self.retry_delay
-        for i in range(1, self.retries + 1):
+        if req.method == 'POST':
+            policy = self.spawn_retry
+        else:
+            policy = self.idempotent_retry
+        deadline = self._deadline(policy.budget)
+        request_timeout = req.request_timeout or self.request_timeout
+        delays = policy.delays()
+        for i in range(1, policy.attempts + 1):
+            time_left = deadline - time.monotonic()
+            if time_left <= 0:
+                raise HTTPError(
+                    599, "Out of time for a request to the Hub API")
+            # No attempt may outlast the deadline.
+            req.request_timeout = min(request_timeout, time_left)
             try:
-                return await AsyncHTTPClient().fetch(req)
+                with self.breaker.guard():
+                    return await fetch(req)
             except HTTPError as e:
                 # swallow 409 errors on retry only (not first attempt)
                 if i > 1 and e.code == 409 and e.response:
@@ -49,22 +455,166 @@ class Launcher():
                 # 599 due to connection issues such as Hub restarting
                 if e.code >= 500:
                     app_log.debug("Error accessing Hub API (using %s): %s", request_url, e)
-                    if i == self.retries:
-                        # last api request failed, raise the exception
+                    delay = next(delays)
+                    if i == policy.attempts or time.monotonic() + delay >= deadline:
+                        # no time for another attempt, raise the exception
                         raise
-                    await gen.sleep(retry_delay)
-                    # exponential backoff for consecutive failures
-                    retry_delay *= 2
+                    metrics.HUB_API_RETRIES.inc()
+                    await gen.sleep(delay)
                 else:
                     raise
 
-    async def get_user_data(self):
-        resp = await self.api_request(
-            'users/%s' % self.user['name'],
-            method='GET',
+    async def get_user_data(self, fresh=False):
+        """
+        Return the Hub's model for this user, possibly from the shared cache.
+
+        Pass fresh=True to skip the cache when the model must reflect changes
+        made since it was cached.
+        """
+        async def fetch():
+            with metrics.HUB_USER_LOOKUP_DURATION.time():
+                resp = await self.api_request(
+                    'users/%s' % self.user['name'],
+                    method='GET',
+                )
+            return json.loads(resp.body.decode('utf-8'))
+
+        with span('hub_user'):
+            return await self.user_cache.get(self.user['name'], fetch,
+                                             fresh=fresh)
+
+    async def wait_for_ready(self, server_name, user_options, started=None):
+        """
+        Wait for a pending server to become ready and return what is known
+        about it, including its 'url'.
+
+        Follow the Hub's progress event stream for the server, which reports
+        the moment it is ready. If the stream is unavailable, poll the user
+        model instead. started is the time.monotonic() at which the spawn
+        was requested, if not just now. Give up spawn_timeout seconds after
+        then, however the server is followed.
+        """
+        if started is None:
+            started = time.monotonic()
+        deadline = self._deadline(self.spawn_timeout, started)
+        try:
+            event = await self._wait_for_progress(server_name, deadline)
+        except web.HTTPError:
+            raise
+        except Exception as e:
+            app_log.debug("Progress stream for server %s of user %s is "
+                          "unavailable (%s); polling instead",
+                          server_name, self.user['name'], e)
+        else:
+            if event is not None:
+                return event
+        return await self._poll_until_ready(server_name, user_options,
+                                            started, deadline)
+
+    async def _wait_for_progress(self, server_name, deadline):
+        """
+        Follow the progress event stream of a pending server, until the
+        time.monotonic() deadline.
+
+        Return the 'ready' event, or None if the stream ended without one.
+        """
+        username = self.user['name']
+        ready = asyncio.get_running_loop().create_future()
+        buffer = b''
+
+        def on_chunk(chunk):
+            # The stream is server-sent events: "data: {...}" lines, with a
+            # blank line after each event.
+            nonlocal buffer
+            buffer += chunk.replace(b'\r\n', b'\n')
+            while b'\n\n' in buffer and not ready.done():
+                message, buffer = buffer.split(b'\n\n', 1)
+                for line in message.splitlines():
+                    if not line.startswith(b'data:'):
+                        continue
+                    event = json.loads(line[len(b'data:'):].decode('utf-8'))
+                    if event.get('ready'):
+                        ready.set_result(event)
+                    elif event.get('failed'):
+                        ready.set_exception(web.HTTPError(
+                            500, "Server %s for user %s failed to launch: %s"
+                            % (server_name, username, event.get('message'))))
+
+        req = HTTPRequest(
+            self.hub_api_url('users/{}/servers/{}/progress'.format(
+                username, server_name)),
+            headers={'Authorization': 'token %s' % self.hub_api_token,
+                     'Accept': 'text/event-stream'},
+            streaming_callback=on_chunk,
+            request_timeout=max(deadline - time.monotonic(), 0.001),
         )
-        body = json.loads(resp.body.decode('utf-8'))
-        return body
+        # The stream is idle most of the time, so it should not hold one of
+        # the client's slots.
+        stream = asyncio.ensure_future(fetch(req, limit=False))
+        await asyncio.wait({ready, stream},
+                           return_when=asyncio.FIRST_COMPLETED)
+        if ready.done():
+            # The Hub ends the stream after the last event; don't wait for it.
+            stream.add_done_callback(
+                lambda f: f.cancelled() or f.exception())
+            return ready.result()
+        # The stream ended first: raise its error, if any.
+        stream.result()
+        return None
+
+    def _poll_intervals(self, user_options, elapsed=0):
+        """
+        Yield the successive delays between polls of a pending server, the
+        first poll being elapsed seconds after its spawn was requested.
+
+        Once recent spawns with the same user_options have been timed, poll
+        at dense_polls percentiles of their durations, from the 10th to the
+        90th: often where many spawns finished, seldom elsewhere, and at
+        most every poll_interval_sparse seconds before the 10th. That finds
+        the server soon after it is ready without polling the Hub throughout
+        the spawn. Without estimates, and after the 90th percentile, back
+        off from poll_interval_min to poll_interval_max.
+        """
+        interval = self.poll_interval_min
+        step = 80 / max(self.dense_polls - 1, 1)
+        marks = self.spawn_times.percentiles(
+            user_options, [10 + step * i for i in range(self.dense_polls)])
+        if marks is not None:
+            limit = self.poll_interval_sparse
+            for mark in marks:
+                while mark - elapsed > self.poll_interval_min:
+                    interval = min(mark - elapsed, limit)
+                    yield interval
+                    elapsed += interval
+                limit = self.poll_interval_max
+        while True:
+            yield interval
+            interval = min(interval * self.poll_backoff,
+                           self.poll_interval_max)
+
+    async def _poll_until_ready(self, server_name, user_options, started,
+                                deadline):
+        """
+        Poll the user model until a pending server, whose spawn was
+        requested at started, is ready, or until deadline.
+        """
+        username = self.user['name']
+        elapsed = time.monotonic() - started
+        for interval in self._poll_intervals(user_options, elapsed):
+            metrics.SPAWN_POLLS.inc()
+            user_data = await self.get_user_data(fresh=True)
+            server = (user_data['servers'] or {}).get(server_name)
+            if server is not None and server['ready']:
+                return server
+            if server is None or not server['pending']:
+                raise web.HTTPError(
+                    500, ("Server with options %s for user %s failed to launch"
+                          % (user_options, username)))
+            if time.monotonic() + interval > deadline:
+                raise web.HTTPError(
+                    500, ("Server with options %s for user %s took too long to launch"
+                          % (user_options, username)))
+            await gen.sleep(interval)
 
     async def launch(self, user_options, server_name, headers):
         """Launch a server for given user_options
@@ -95,46 +645,33 @@ class Launcher():
         # start server
         app_log.info("Starting server %s for user %s with options %s",
                      server_name, username, user_options)
+        spawn_started = time.monotonic()
         try:
-            resp = await self.api_request(
-                'users/{}/servers/{}'.format(username, server_name),
-                method='POST',
-                body=json.dumps(data).encode('utf8'),
-                headers=headers,
-            )
+            with span('spawn_request'):
+                resp = await self.api_request(
+                    'users/{}/servers/{}'.format(username, server_name),
+                    method='POST',
+                    body=json.dumps(data).encode('utf8'),
+                    headers=headers,
+                )
+            # The user's servers have changed, whether or not the new one is
+            # ready yet.
+            self.user_cache.invalidate(username)
 
             if resp.code == 202:
                 # Server hasn't actually started yet
                 # We wait for it!
-                # NOTE: This ends up being about ten minutes
-                for i in range(64):
-                    user_data = await self.get_user_data()
-
-                    server = user_data['servers'][server_name]
-                    if server['ready']:
-                        # exit, server running
-                        return {'status': 'running',
-                                'url': server['url']}
-
-                    if server['progress_url']:
-                        # exit, server pending with progress url
-                        return {'url': server['progress_url'],
-                                'status': 'pending'}
-
-                    if not server['pending']:
-                        raise web.HTTPError(
-                            500, ("Server with options %s for user %s failed to launch"
-                                  % (user_options, username)))
-                    # FIXME: make this configurable
-                    # FIXME: Measure how long it takes for servers to start
-                    # and tune this appropriately
-                    await gen.sleep(min(1.4 ** i, 10))
-                else:
-                    raise web.HTTPError(
-                        500, ("Server with options %s for user %s took too long to launch"
-                              % (user_options, username)))
+                with span('spawn_wait'):
+                    server = await self.wait_for_ready(
+                        server_name, user_options, spawn_started)
+                # Anything cached while the server was pending is stale.
+                self.user_cache.invalidate(username)
+                self._record_spawn('success', spawn_started, user_options)
+                return {'status': 'running', 'url': server['url']}
 
         except HTTPError as e:
+            self.user_cache.invalidate(username)
+            self._record_spawn('failure', spawn_started, user_options)
             if e.response:
                 body = e.response.body
             else:
@@ -144,5 +681,76 @@ class Launcher():
                           format(server_name, username, e, body))
             raise web.HTTPError(500, "Failed to launch with options %s" %
                     user_options)
+        except web.HTTPError:
+            self._record_spawn('failure', spawn_started, user_options)
+            raise
 
+        self._record_spawn('success', spawn_started, user_options)
         return {'url': '/user/%s/%s' % (username, server_name), 'status': 'running'}
+
+    def _record_spawn(self, outcome, started, user_options):
+        metrics.SPAWNS.labels(self.role, outcome).inc()
+        if outcome == 'success':
+            duration = time.monotonic() - started
+            metrics.SPAWN_DURATION.labels(self.role).observe(duration)
+            self.spawn_times.record(user_options, duration)
+
+    async def stop(self, server_name):
+        "Stop a named server and remove it from the Hub."
+        username = self.user['name']
+        app_log.info("Stopping server %s for user %s", server_name, username)
+        try:
+            await self.api_request(
+                'users/{}/servers/{}'.format(username, server_name),
+                method='DELETE',
+                body=json.dumps({'remove': True}).encode('utf8'),
+                allow_nonstandard_methods=True,
+            )
+        finally:
+            self.user_cache.invalidate(username)
+
+    async def find_or_launch(self, user_options, headers):
+        """
+        Return the model of a server of this user spawned with user_options.
+
+        Use a currently-running server if there is one; otherwise start one
+        with a random name and wait for it.
+        """
+        user_data = await self.get_user_data()
+        for server in (user_data['servers'] or {}).values():
+            if server['user_options'] == user_options:
+                return server
+        # No currently-running server was spawned with the same user_options
+        # as the one shared from.
+        return await self.launch_matching(user_options, headers)
+
+    async def launch_matching(self, user_options, headers):
+        """
+        Start a server with user_options and a random name, and return its
+        model once it is running.
+
+        If this process is already starting such a server for this user,
+        wait for that one instead.
+        """
+        key = (self.user['name'], canonical_options(user_options))
+        task = self.pending_launches.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._launch_new(user_options, headers))
+            self.pending_launches[key] = task
+            task.add_done_callback(
+                lambda _: self.pending_launches.pop(key, None))
+        else:
+            app_log.info("Waiting for pending launch of a server for user %s "
+                         "with options %s", self.user['name'], user_options)
+        # Shield the shared launch so that one cancelled waiter does not
+        # cancel it for everyone else.
+        return await asyncio.shield(task)
+
+    async def _launch_new(self, user_options, headers):
+        server_name = f'shared-link-{str(uuid.uuid4())[:8]}'
+        pending_server = await self.launch(
+            user_options, server_name, headers=headers)
+        assert pending_server['status'] == 'running'
+        user_data = await self.get_user_data()
+        return user_data['servers'][server_name]
@@ -0,0 +1,297 @@
+"""
+Replay share-link traffic against a running service, for capacity planning.
+
+Workloads:
+
+    create-burst  the sender creates links, cycling through the paths
+    classroom     the sender creates one link, which every recipient opens
+    large-files   the sender creates a link to each path, and recipients
+                  open them at random
+
+Requests are either closed-loop, with a fixed number in flight, or arrive
+open-loop at a given mean rate (--rate), in which case each latency is
+measured from when the request was due, so that time spent queued behind
+the concurrency limit is counted. Every request is written out as CSV or JSON
+and a summary is printed to stderr.
+
+    jupyterhub-share-link-loadgen classroom \\
+        --url https://hub.example.org/services/share-link/ \\
+        --sender-token $TEACHER_TOKEN --base-url /user/teacher/ \\
+        --path lesson.ipynb --recipient-tokens-file students.txt \\
+        --requests 300 --rate 10
+"""
+import argparse
+import asyncio
+import csv
+import json
+import random
+import sys
+import time
+
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+
+WORKLOADS = ('create-burst', 'classroom', 'large-files')
+FIELDS = ('workload', 'operation', 'started', 'latency', 'status', 'error')
+
+
+def percentile(sorted_values, q):
+    "Return the q-th percentile (0-100) of sorted values, by nearest rank."
+    if not sorted_values:
+        return float('nan')
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class LoadClient():
+    "Create and open links through the service's HTTP API."
+
+    def __init__(self, url, host=None, concurrency=10, timeout=600):
+        if not url.endswith('/'):
+            url += '/'
+        self.url = url
+        self.host = host
+        self.timeout = timeout
+        self.client = AsyncHTTPClient(force_instance=True,
+                                      max_clients=concurrency)
+
+    def _headers(self, token):
+        headers = {'Authorization': f'token {token}'}
+        if self.host is not None:
+            headers['Host'] = self.host
+        return headers
+
+    async def create(self, token, base_url, path):
+        "Create a link to path on the server at base_url; return (code, link)."
+        resp = await self.client.fetch(HTTPRequest(
+            self.url + 'create', method='POST', headers=self._headers(token),
+            body=json.dumps({'path': path, 'base_url': base_url}),
+            request_timeout=self.timeout), raise_error=False)
+        link = None
+        if resp.code == 200:
+            link = json.loads(resp.body)['link']
+        return resp.code, link
+
+    async def open(self, token, link):
+        "Open link as the user of token; return the status code."
+        query = link.split('?', 1)[1]
+        resp = await self.client.fetch(HTTPRequest(
+            self.url + 'open?' + query, headers=self._headers(token),
+            follow_redirects=False, request_timeout=self.timeout),
+            raise_error=False)
+        return resp.code
+
+    def close(self):
+        self.client.close()
+
+
+class LoadGenerator():
+    "Issue requests for a workload and record how each one went."
+
+    def __init__(self, client, workload, concurrency=10, rate=None):
+        self.client = client
+        self.workload = workload
+        self.concurrency = concurrency
+        self.rate = rate
+        self.records = []
+        self._started = None
+
+    async def _record(self, operation, due, request, expected):
+        """
+        Await request, which returns (status code, result), and record it.
+
+        The latency is measured from due, the time the request should have
+        started.
+        """
+        status, result, error = None, None, ''
+        try:
+            status, result = await request
+        except Exception as e:
+            error = repr(e)
+        else:
+            if status != expected:
+                error = f'expected {expected}'
+        self.records.append({'workload': self.workload,
+                             'operation': operation,
+                             'started': due - self._started,
+                             'latency': time.perf_counter() - due,
+                             'status': status,
+                             'error': error})
+        return result
+
+    async def run(self, count, operation, make_request, expected):
+        """
+        Issue count requests, make_request(i) returning an awaitable of
+        (status code, result). Return the results, in order.
+        """
+        if self._started is None:
+            self._started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def one(i, due):
+            async with semaphore:
+                if due is None:
+                    # Closed loop: each request is due when a slot frees up.
+                    due = time.perf_counter()
+                return await self._record(operation, due, make_request(i),
+                                          expected)
+
+        tasks = []
+        due = time.perf_counter()
+        for i in range(count):
+            if self.rate:
+                # Open loop: arrivals do not wait for earlier requests.
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.ensure_future(one(i, due)))
+                due += random.expovariate(self.rate)
+            else:
+                tasks.append(asyncio.ensure_future(one(i, None)))
+        return await asyncio.gather(*tasks)
+
+    def summary(self):
+        "Return statistics for each operation."
+        summary = {}
+        for operation in sorted({r['operation'] for r in self.records}):
+            records = [r for r in self.records
+                       if r['operation'] == operation]
+            ok = sorted(r['latency'] for r in records if not r['error'])
+            span = max(r['started'] + r['latency'] for r in records)
+            span -= min(r['started'] for r in records)
+            summary[operation] = {
+                'requests': len(records),
+                'errors': len(records) - len(ok),
+                'p50': percentile(ok, 50),
+                'p95': percentile(ok, 95),
+                'p99': percentile(ok, 99),
+                'throughput': len(ok) / span if span > 0 else float('nan')}
+        return summary
+
+
+async def run_workload(generator, args):
+    "Run the workload named by args.workload with generator."
+    client = generator.client
+    paths = args.path
+    recipients = args.recipient_token
+
+    def create(i):
+        return client.create(args.sender_token, args.base_url,
+                             paths[i % len(paths)])
+
+    def open_as(i, link):
+        async def request():
+            return await client.open(recipients[i % len(recipients)],
+                                     link), None
+        return request()
+
+    if args.workload == 'create-burst':
+        await generator.run(args.requests, 'create', create, 200)
+        return
+    if args.workload == 'classroom':
+        link, = await generator.run(1, 'create', create, 200)
+        if link is None:
+            raise RuntimeError("Could not create the link to open.")
+        await generator.run(args.requests, 'open',
+                            lambda i: open_as(i, link), 302)
+        return
+    links = await generator.run(len(paths), 'create', create, 200)
+    links = [link for link in links if link is not None]
+    if not links:
+        raise RuntimeError("Could not create any link to open.")
+    choices = random.Random(args.seed)
+    await generator.run(args.requests, 'open',
+                        lambda i: open_as(i, choices.choice(links)), 302)
+
+
+def write_records(records, file, output_format, summary=None):
+    "Write the records, as CSV rows or as one JSON document with a summary."
+    if output_format == 'csv':
+        writer = csv.DictWriter(file, FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        json.dump({'summary': summary, 'requests': records}, file, indent=1)
+        file.write('\n')
+
+
+def print_summary(summary, file=sys.stderr):
+    print(f'{"operation":>9} {"requests":>8} {"errors":>6} {"p50 ms":>9} '
+          f'{"p95 ms":>9} {"p99 ms":>9} {"per s":>9}', file=file)
+    for operation, stats in summary.items():
+        print(f'{operation:>9} {stats["requests"]:8d} {stats["errors"]:6d} '
+              f'{1000 * stats["p50"]:9.1f} {1000 * stats["p95"]:9.1f} '
+              f'{1000 * stats["p99"]:9.1f} {stats["throughput"]:9.1f}',
+              file=file)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split('\n\n', 1)[1])
+    parser.add_argument('workload', choices=WORKLOADS)
+    parser.add_argument('--url', required=True,
+                        help="URL of the service, including its prefix")
+    parser.add_argument('--host',
+                        help="Host header to send, if --url bypasses the "
+                             "proxy that user servers are reached through")
+    parser.add_argument('--sender-token', required=True,
+                        help="API token of the user who creates links")
+    parser.add_argument('--base-url', required=True,
+                        help="URL path of the sender's server, such as "
+                             "/user/teacher/")
+    parser.add_argument('--path', action='append', required=True,
+                        help="path of a file to share (may be repeated)")
+    parser.add_argument('--recipient-token', action='append', default=[],
+                        help="API token of a user who opens links "
+                             "(may be repeated)")
+    parser.add_argument('--recipient-tokens-file',
+                        type=argparse.FileType('r'),
+                        help="file of recipients' API tokens, one per line")
+    parser.add_argument('--requests', type=int, default=100,
+                        help="links to create (create-burst) or open")
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help="most requests in flight at once")
+    parser.add_argument('--rate', type=float,
+                        help="mean arrivals per second (open loop); by "
+                             "default, requests are closed-loop")
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+    parser.add_argument('--output', type=argparse.FileType('w'),
+                        default=sys.stdout,
+                        help="where to write the records (default: stdout)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.recipient_tokens_file is not None:
+        with args.recipient_tokens_file as file:
+            args.recipient_token += [line.strip() for line in file
+                                     if line.strip()]
+    if args.workload != 'create-burst' and not args.recipient_token:
+        parser.error(f"{args.workload} needs at least one recipient token")
+    return args
+
+
+async def _main(args):
+    random.seed(args.seed)
+    client = LoadClient(args.url, host=args.host,
+                        concurrency=args.concurrency)
+    generator = LoadGenerator(client, args.workload,
+                              concurrency=args.concurrency, rate=args.rate)
+    try:
+        await run_workload(generator, args)
+    finally:
+        client.close()
+    return generator
+
+
+def main(argv=None):
+    "Entry point of jupyterhub-share-link-loadgen."
+    args = parse_args(argv)
+    generator = asyncio.run(_main(args))
+    summary = generator.summary()
+    write_records(generator.records, args.output, args.format, summary)
+    print_summary(summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Prometheus metrics, served at /metrics.
+
+Each worker process counts for itself. With several workers, set
+PROMETHEUS_MULTIPROC_DIR to a directory they can all write to, and /metrics
+serves the totals over every worker, whichever one answers the scrape.
+"""
+import os
+import pathlib
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from jupyterhub.services.auth import HubAuthenticated
+from tornado.log import access_log
+from tornado.web import HTTPError, RequestHandler
+
+
+# Spawns and large copies take far longer than the default buckets allow for.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+           120, 300, 600, float('inf'))
+
+REQUEST_DURATION = Histogram(
+    'share_link_request_duration_seconds',
+    "End-to-end time to handle a request",
+    ['handler'], buckets=BUCKETS)
+TOKEN_VERIFY_DURATION = Histogram(
+    'share_link_token_verify_duration_seconds',
+    "Time to verify a share token, including cache hits",
+    buckets=BUCKETS)
+HUB_USER_LOOKUP_DURATION = Histogram(
+    'share_link_hub_user_lookup_duration_seconds',
+    "Time to fetch a user model from the Hub API, excluding cache hits",
+    buckets=BUCKETS)
+SPAWN_DURATION = Histogram(
+    'share_link_spawn_duration_seconds',
+    "Time from requesting a server to it being ready",
+    ['role'], buckets=BUCKETS)
+CONTENT_FETCH_DURATION = Histogram(
+    'share_link_content_fetch_duration_seconds',
+    "Time to read content from the source server",
+    buckets=BUCKETS)
+HTTP_CLIENT_WAIT_DURATION = Histogram(
+    'share_link_http_client_wait_seconds',
+    "Time a request to the Hub or a user server waited for a client slot",
+    buckets=BUCKETS)
+CONTENT_PUT_DURATION = Histogram(
+    'share_link_content_put_duration_seconds',
+    "Time to write content to the destination server",
+    buckets=BUCKETS)
+
+SPAWNS = Counter(
+    'share_link_spawns_total',
+    "Servers spawned, by role and outcome",
+    ['role', 'outcome'])
+SPAWN_POLLS = Counter(
+    'share_link_spawn_polls_total',
+    "Polls of the Hub for whether a pending server is ready")
+HUB_API_RETRIES = Counter(
+    'share_link_hub_api_retries_total',
+    "Hub API requests retried after an error")
+HUB_CIRCUIT_OPENED = Counter(
+    'share_link_hub_circuit_opened_total',
+    "Times the circuit breaker around the Hub API opened")
+HUB_CIRCUIT_REJECTED = Counter(
+    'share_link_hub_circuit_rejected_total',
+    "Hub API requests not made because the circuit breaker was open")
+ERRORS = Counter(
+    'share_link_errors_total',
+    "Responses with an error status, by handler and status code",
+    ['handler', 'code'])
+
+HUB_CIRCUIT_STATE = Gauge(
+    'share_link_hub_circuit_state',
+    "State of the circuit breaker around the Hub API: "
+    "0 closed, 1 half-open, 2 open",
+    multiprocess_mode='max')
+HTTP_CLIENT_ACTIVE = Gauge(
+    'share_link_http_client_active',
+    "Requests to the Hub and user servers in flight",
+    multiprocess_mode='livesum')
+HTTP_CLIENT_QUEUED = Gauge(
+    'share_link_http_client_queued',
+    "Requests to the Hub and user servers waiting for a client slot, by host",
+    ['host'], multiprocess_mode='livesum')
+
+
+def multiprocess_dir():
+    "Return the directory shared by worker processes' metrics, or None."
+    return os.getenv('PROMETHEUS_MULTIPROC_DIR') or None
+
+
+def clear_multiprocess_dir():
+    """
+    Remove metrics left by other processes, such as the workers of a
+    previous run. Call before forking workers.
+    """
+    path = multiprocess_dir()
+    if path is None:
+        return
+    # Files are named <type>_<pid>.db. This process's own are in use.
+    for db in pathlib.Path(path).glob('*.db'):
+        if db.stem.rpartition('_')[2] != str(os.getpid()):
+            db.unlink()
+
+
+def registry():
+    "Return the registry to serve: this process's, or every worker's."
+    if multiprocess_dir() is None:
+        return REGISTRY
+    merged = CollectorRegistry()
+    multiprocess.MultiProcessCollector(merged)
+    return merged
+
+
+def log_request(handler):
+    """
+    Record metrics for a finished request, then log it as tornado would.
+
+    Set as the Application's log_function.
+    """
+    name = type(handler).__name__
+    status = handler.get_status()
+    request_time = handler.request.request_time()
+    REQUEST_DURATION.labels(name).observe(request_time)
+    if status >= 400:
+        ERRORS.labels(name, str(status)).inc()
+
+    if status < 400:
+        log_method = access_log.info
+    elif status < 500:
+        log_method = access_log.warning
+    else:
+        log_method = access_log.error
+    log_method("%d %s %.2fms", status, handler._request_summary(),
+               1000.0 * request_time)
+
+
+class MetricsHandler(HubAuthenticated, RequestHandler):
+    """
+    Serve metrics in the Prometheus text format.
+
+    Like JupyterHub's own /metrics, this requires a Hub token or login unless
+    authentication is turned off.
+    """
+
+    authenticate = os.getenv('JUPYTERHUB_SHARE_LINK_AUTHENTICATE_METRICS',
+                             '1') not in ('0', 'false', 'False')
+
+    async def get(self):
+        if self.authenticate and self.current_user is None:
+            raise HTTPError(403)
+        self.set_header('Content-Type', CONTENT_TYPE_LATEST)
+        self.write(generate_latest(registry()))
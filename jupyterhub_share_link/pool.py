@@ -0,0 +1,210 @@
+"""
+Keep servers spawned ahead of time for the likely recipients of share links.
+
+JupyterHub servers belong to a user, so a server cannot be spawned for nobody
+in particular and handed to whoever opens a link. Instead, the pool learns
+which user_options are shared most often, from the tokens issued, and who
+opens links. It keeps idle servers with those options running for recent
+recipients. Opening a link then finds a matching server that is already
+running, rather than waiting for a spawn.
+"""
+import asyncio
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+import os
+import time
+
+from tornado.log import app_log
+
+from .launcher import HubUnavailable, Launcher, canonical_options
+
+
+class WarmPool():
+    """
+    Idle, pre-spawned servers keyed by user and canonical user_options.
+
+    At most size idle servers are kept, for the options_count most popular
+    user_options. An idle server is stopped once it has had no activity for
+    ttl seconds. When the pool is full, eviction chooses which idle server
+    with no-longer-popular options to stop: 'least-popular' or 'oldest'.
+    """
+
+    size = int(os.getenv('JUPYTERHUB_SHARE_LINK_POOL_SIZE', 0))
+    options_count = int(os.getenv('JUPYTERHUB_SHARE_LINK_POOL_OPTIONS', 1))
+    ttl = float(os.getenv('JUPYTERHUB_SHARE_LINK_POOL_TTL', 1800))
+    recipient_ttl = float(os.getenv(
+        'JUPYTERHUB_SHARE_LINK_POOL_RECIPIENT_TTL', 7 * 24 * 3600))
+    eviction = os.getenv('JUPYTERHUB_SHARE_LINK_POOL_EVICTION',
+                         'least-popular')
+    max_tracked_options = 256
+    # Seconds to leave a recipient out of refills after a spawn for them
+    # failed, e.g. because they have as many servers as the Hub allows.
+    failure_backoff = 300
+
+    def __init__(self, api_token):
+        self.api_token = api_token
+        self.popularity = Counter()  # options key -> number of tokens issued
+        # options key -> user_options, least recently issued first
+        self.options = {}
+        self.recipients = OrderedDict()  # username -> time of last open
+        self.idle = {}  # (username, server name) -> (options key, spawned)
+        self.failed = {}  # username -> time of a failed spawn
+        self.stats = Counter(hits=0, misses=0, spawned=0, evicted=0,
+                             expired=0, failed=0)
+        self._refilling = None
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def status(self):
+        "Return a summary of the pool for reporting."
+        return {'size': self.size,
+                'idle': len(self.idle),
+                **self.stats}
+
+    def record_issued(self, user_options):
+        "Learn from a token issued for a server with user_options."
+        key = canonical_options(user_options)
+        self.popularity[key] += 1
+        self.options.pop(key, None)
+        self.options[key] = user_options
+        if len(self.popularity) > self.max_tracked_options:
+            # Forget the least popular options, and of those the least
+            # recently issued, so that new options can build up demand.
+            least = min((k for k in self.options if k != key),
+                        key=self.popularity.__getitem__)
+            del self.popularity[least]
+            del self.options[least]
+        self.schedule_refill()
+
+    def claim(self, username, server_name):
+        """
+        Note that username opened a link into server_name.
+
+        Return True if that server came from the pool.
+        """
+        self.recipients[username] = time.monotonic()
+        self.recipients.move_to_end(username)
+        if self.idle.pop((username, server_name), None) is not None:
+            self.stats['hits'] += 1
+            hit = True
+        else:
+            self.stats['misses'] += 1
+            hit = False
+        self.schedule_refill()
+        return hit
+
+    def schedule_refill(self):
+        "Start refilling the pool in the background, unless already doing so."
+        if not self.enabled:
+            return
+        if self._refilling is not None and not self._refilling.done():
+            return
+        self._refilling = asyncio.ensure_future(self.refill())
+        self._refilling.add_done_callback(self._log_refill_error)
+
+    @staticmethod
+    def _log_refill_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            app_log.error("Failed to refill the warm server pool",
+                          exc_info=future.exception())
+
+    async def refill(self):
+        "Stop expired servers and spawn servers that are wanted but missing."
+        self._forget_old_recipients()
+        await self.cull()
+        wanted = [key for key, _ in
+                  self.popularity.most_common(self.options_count)]
+        # Serve the most recent recipients first.
+        for username in reversed(list(self.recipients)):
+            if username in self.failed:
+                continue
+            for key in wanted:
+                if any(user == username and idle_key == key
+                       for (user, _), (idle_key, _) in self.idle.items()):
+                    continue
+                if len(self.idle) >= self.size and not await self.evict(wanted):
+                    return
+                try:
+                    await self._spawn(username, key)
+                except HubUnavailable:
+                    raise
+                except Exception:
+                    # Don't let one recipient hold up everyone else's.
+                    app_log.warning("Failed to spawn a warm server for %s; "
+                                    "skipping them for %ds", username,
+                                    self.failure_backoff, exc_info=True)
+                    self.failed[username] = time.monotonic()
+                    self.stats['failed'] += 1
+                    break
+
+    async def _spawn(self, username, key):
+        launcher = Launcher({'name': username}, self.api_token, role='pool')
+        user_options = self.options[key]
+        user_data = await launcher.get_user_data()
+        for server in (user_data['servers'] or {}).values():
+            if server['user_options'] == user_options:
+                # The recipient already has a suitable server.
+                return
+        server = await launcher.launch_matching(user_options, headers={})
+        self.idle[(username, server['name'])] = (key, time.monotonic())
+        self.stats['spawned'] += 1
+
+    async def evict(self, wanted):
+        """
+        Stop one idle server whose options are not wanted, to make room.
+
+        Return False if there was none.
+        """
+        candidates = [(member, key, spawned)
+                      for member, (key, spawned) in self.idle.items()
+                      if key not in wanted]
+        if not candidates:
+            return False
+        if self.eviction == 'oldest':
+            order = (lambda c: c[2])
+        else:
+            order = (lambda c: (self.popularity[c[1]], c[2]))
+        member, _, _ = min(candidates, key=order)
+        await self._stop(member)
+        self.stats['evicted'] += 1
+        return True
+
+    async def cull(self):
+        "Stop idle servers that have had no activity for ttl seconds."
+        now = datetime.now(timezone.utc)
+        for username, server_name in list(self.idle):
+            launcher = Launcher({'name': username}, self.api_token)
+            user_data = await launcher.get_user_data()
+            server = (user_data['servers'] or {}).get(server_name)
+            if server is None:
+                # Stopped by someone else.
+                del self.idle[(username, server_name)]
+                continue
+            last_activity = server.get('last_activity')
+            if last_activity is None:
+                continue
+            last_activity = datetime.fromisoformat(
+                last_activity.replace('Z', '+00:00'))
+            idle_for = (now - last_activity).total_seconds()
+            if idle_for > self.ttl:
+                await self._stop((username, server_name))
+                self.stats['expired'] += 1
+
+    async def _stop(self, member):
+        username, server_name = member
+        del self.idle[member]
+        await Launcher({'name': username}, self.api_token).stop(server_name)
+
+    def _forget_old_recipients(self):
+        cutoff = time.monotonic() - self.failure_backoff
+        for username, failed in list(self.failed.items()):
+            if failed < cutoff:
+                del self.failed[username]
+        cutoff = time.monotonic() - self.recipient_ttl
+        while self.recipients:
+            username, last_open = next(iter(self.recipients.items()))
+            if last_open >= cutoff:
+                break
+            del self.recipients[username]
@@ -0,0 +1,90 @@
+"""
+Revoked links, checked in memory and optionally persisted in SQLite.
+
+Every link has a unique 'jti' claim. Revoking a link records its jti until
+the link would have expired anyway. Each worker process keeps the jtis in a
+dict, so checking a link costs one hash lookup. With a store configured, it
+also picks up links revoked by other workers when it refreshes; without one,
+revocations last only as long as the process that made them.
+"""
+from collections import Counter
+import os
+import sqlite3
+import time
+
+
+class RevocationList():
+    "The jtis of revoked links that have not yet expired."
+
+    path = os.getenv('JUPYTERHUB_SHARE_LINK_REVOCATION_STORE')
+    # Seconds between reads of the links revoked by other workers.
+    refresh_interval = float(os.getenv(
+        'JUPYTERHUB_SHARE_LINK_REVOCATION_REFRESH', 5))
+
+    def __init__(self, path=None):
+        if path is not None:
+            self.path = path
+        self._revoked = {}  # jti -> exp
+        self._last_id = 0
+        self.stats = Counter(revoked=0, rejected=0)
+        self._db = None
+        if self.persistent:
+            self._db = sqlite3.connect(self.path, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            # AUTOINCREMENT keeps ids increasing after old rows are purged,
+            # so that refresh() can read only the rows added since it last
+            # ran.
+            self._db.execute('CREATE TABLE IF NOT EXISTS revoked ('
+                             'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                             'jti TEXT UNIQUE NOT NULL, exp REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS revoked_exp '
+                             'ON revoked (exp)')
+            self.refresh()
+
+    @property
+    def persistent(self):
+        return bool(self.path)
+
+    def is_revoked(self, claims):
+        "Return True if the link with these claims has been revoked."
+        jti = claims.get('jti')
+        if jti is not None and jti in self._revoked:
+            self.stats['rejected'] += 1
+            return True
+        return False
+
+    def revoke(self, claims):
+        "Revoke the link with these claims, until it expires."
+        jti = claims.get('jti')
+        if jti is None:
+            raise ValueError("Links issued without a jti cannot be revoked.")
+        if self._db is not None:
+            self._db.execute(
+                'INSERT OR IGNORE INTO revoked (jti, exp) VALUES (?, ?)',
+                (jti, claims['exp']))
+        self._revoked[jti] = claims['exp']
+        self.stats['revoked'] += 1
+
+    def refresh(self):
+        "Load links revoked by other worker processes."
+        if self._db is None:
+            return
+        rows = self._db.execute(
+            'SELECT id, jti, exp FROM revoked WHERE id > ? ORDER BY id',
+            (self._last_id,)).fetchall()
+        for row_id, jti, exp in rows:
+            self._revoked[jti] = exp
+            self._last_id = row_id
+
+    def purge(self):
+        "Forget revoked links that have expired."
+        now = time.time()
+        if self._db is not None:
+            self._db.execute('DELETE FROM revoked WHERE exp <= ?', (now,))
+        for jti in [jti for jti, exp in self._revoked.items() if exp <= now]:
+            del self._revoked[jti]
+
+    def status(self):
+        "Return a summary of the list for reporting."
+        return {'persistent': self.persistent, 'size': len(self._revoked),
+                **self.stats}
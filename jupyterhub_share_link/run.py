@@ -1,41 +1,192 @@
-import base64
+import asyncio
+import calendar
 from datetime import datetime, timedelta
+import functools
 import json
 import os
 import pathlib
+import secrets
 import sys
-import uuid
+import time
 
 import jwt
 import tornado.options
 from jupyterhub.services.auth import HubAuthenticated
 from jupyterhub.utils import url_path_join
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
 from tornado.httpserver import HTTPServer
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
 from tornado.log import app_log
-from tornado.web import Application
+from tornado.netutil import bind_sockets
+from tornado.process import fork_processes, task_id
+from tornado.web import Application, HTTPError
 from tornado.web import authenticated
 from tornado.web import RequestHandler
-from urllib.parse import urlparse, quote as urlquote
-
-from .launcher import Launcher
+from urllib.parse import parse_qs, urlparse, quote as urlquote
+
+from .clients import HTTPClientPool
+from .launcher import HubUnavailable, Launcher
+from .metrics import (TOKEN_VERIFY_DURATION, MetricsHandler,
+                      clear_multiprocess_dir, log_request, multiprocess_dir)
+from .pool import WarmPool
+from .revocations import RevocationList
+from .shortlinks import ShortLinkStore
+from .snapshots import SnapshotStore
+from .tokens import (TokenSigner, VerifiedTokenCache, load_private_key,
+                     load_public_key)
+from .tracing import TracedHandler, load_exporter, span, traced
+from .transfer import ContentTransfer
 from ._version import get_versions
 
 
 HubAuthenticated.hub_auth
 
-private_key_path = os.getenv('JUPYTERHUB_SHARE_LINK_PRIVATE_KEY', "private.pem")
-private_key = pathlib.Path(private_key_path).read_text()
-public_key_path = os.getenv('JUPYTERHUB_SHARE_LINK_PUBLIC_KEY', "public.pem")
-public_key = pathlib.Path(public_key_path).read_text()
 
+def load_signer():
+    "Return a TokenSigner for the keys named by the environment."
+    # Unset means whatever algorithm goes with the keys. A shared secret
+    # must be asked for explicitly, so that a key file that fails to parse
+    # is not mistaken for one.
+    algorithm = os.getenv('JUPYTERHUB_SHARE_LINK_ALGORITHM') or None
+    private_key_path = os.getenv('JUPYTERHUB_SHARE_LINK_PRIVATE_KEY',
+                                 "private.pem")
+    private_key = load_private_key(
+        pathlib.Path(private_key_path).read_bytes(), algorithm)
+    public_key_path = os.getenv('JUPYTERHUB_SHARE_LINK_PUBLIC_KEY',
+                                "public.pem")
+    public_key = load_public_key(
+        pathlib.Path(public_key_path).read_bytes(), algorithm)
+    signer = TokenSigner(private_key, public_key)
+    if algorithm is not None and signer.algorithm != algorithm:
+        raise ValueError(
+            f"JUPYTERHUB_SHARE_LINK_ALGORITHM is {algorithm}, but the keys "
+            f"are for {signer.algorithm}.")
+    return signer
+
+
+async def verify_token(settings, unverified_link_token):
+    """
+    Return the claims of a share token, checking its signature and expiry.
+
+    settings are the Application's, which hold the signer and the cache of
+    verified tokens.
+    """
+    with TOKEN_VERIFY_DURATION.time():
+        return await _verify_token(settings['signer'],
+                                   settings['verified_tokens'],
+                                   unverified_link_token)
+
+
+async def _verify_token(signer, verified_tokens, unverified_link_token):
+    token = verified_tokens.get(unverified_link_token)
+    if token is not None:
+        return token
+    try:
+        token = await signer.decode_link(unverified_link_token)
+    except jwt.exceptions.ExpiredSignatureError:
+        raise HTTPError(
+            403, "Sharing link has expired. Ask for a fresh link."
+        )
+    except jwt.exceptions.InvalidSignatureError:
+        raise HTTPError(
+            403, ("Sharing link has an invalid signature. Was it "
+                  "copy/pasted in full?")
+        )
+    except (jwt.exceptions.InvalidTokenError, ValueError):
+        raise HTTPError(
+            403, "Sharing link is malformed. Was it copy/pasted in full?"
+        )
+    verified_tokens.put(unverified_link_token, token)
+    return token
+
+
+async def read_link(settings, link_id=None, token=None):
+    """
+    Return the claims of a link, given either the id of a short link or a
+    signed token, checking that it is genuine and has not expired.
+    """
+    if link_id is None:
+        if token is None:
+            raise HTTPError(400, "A link has either an id or a token.")
+        return await verify_token(settings, token)
+    short_links = settings['short_links']
+    claims = short_links.get(link_id) if short_links.enabled else None
+    if claims is None:
+        raise HTTPError(
+            403, ("Sharing link not found. Was it copy/pasted in full? "
+                  "If it is old, it may have expired.")
+        )
+    if claims['exp'] <= time.time():
+        raise HTTPError(
+            403, "Sharing link has expired. Ask for a fresh link."
+        )
+    return claims
+
+
+async def link_claims(handler):
+    """
+    Return the claims of the link a request opens or inspects, checking
+    that it has not been revoked.
+    """
+    claims = await read_link(handler.settings,
+                             link_id=handler.get_argument('id', None),
+                             token=handler.get_argument('token', None))
+    if handler.settings['revocations'].is_revoked(claims):
+        raise HTTPError(
+            403, "Sharing link has been revoked by the person who shared it."
+        )
+    return claims
+
+
+async def gather_or_cancel(*futures):
+    """
+    Like asyncio.gather, but cancel the rest as soon as any one fails.
+    """
+    done, pending = await asyncio.wait(
+        set(futures), return_when=asyncio.FIRST_EXCEPTION)
+    for future in pending:
+        future.cancel()
+    for future in done:
+        if future.exception() is not None:
+            raise future.exception()
+    return [future.result() for future in futures]
 
-class CreateSharedLink(HubAuthenticated, RequestHandler):
+
+class DeadlineHandler():
+    """
+    Mixin for a RequestHandler that gives up on the Hub request_timeout
+    seconds after a request starts.
+
+    Launchers made with deadline=self.deadline stop retrying requests to the
+    Hub, and stop waiting for spawns, by then. While the Hub is unavailable,
+    responses say when to try again in a Retry-After header.
+    """
+
+    request_timeout = float(os.getenv('JUPYTERHUB_SHARE_LINK_REQUEST_TIMEOUT',
+                                      900))
+
+    def prepare(self):
+        self.deadline = time.monotonic() + self.request_timeout
+        return super().prepare()
+
+    def write_error(self, status_code, **kwargs):
+        exc_info = kwargs.get('exc_info')
+        if exc_info is not None and isinstance(exc_info[1], HubUnavailable):
+            self.set_header('Retry-After', str(exc_info[1].retry_after))
+        super().write_error(status_code, **kwargs)
+
+
+class CreateSharedLink(DeadlineHandler, TracedHandler, HubAuthenticated,
+                       RequestHandler):
     @authenticated
     async def post(self):
         data = json.loads(self.request.body.decode('utf-8'))
+        expiration_time = self._expiration_time(data)
+        with span('find_source'):
+            source_server = await self._find_source_server(data['base_url'])
+        link = await self._issue(data['path'], source_server, expiration_time)
+        self.write({'link': link})
 
+    def _expiration_time(self, data):
         now = datetime.utcnow()
         if data.get('expiration_time') is not None:
             expiration_time = datetime.fromtimestamp(data['expiration_time'])
@@ -50,61 +201,133 @@ class CreateSharedLink(HubAuthenticated, RequestHandler):
                 403, (f"expiration_time must no more than two days "
                       f"from now (current max: {max_time.timestamp()})")
             )
-        current_user = self.get_current_user()
+        return expiration_time
 
+    async def _find_source_server(self, server_base_url):
         # In JupyterLab 2.0, the front-end will be able to tell us the name of
         # the server that this request came from, Until then, it can only give
         # us the server's base URL. To map that to a server name, we have to
         # loop through the dict of servers and find the matching URL. Once we
         # have the name, we can look it up directly.
-        launcher = Launcher(current_user, self.hub_auth.api_token)
-        resp = await launcher.api_request(
-            url_path_join('users', current_user['name']),
-            method='GET',
-        )
-        source_user_data = json.loads(resp.body.decode('utf-8'))
-        for server in (source_user_data['servers'] or {}).values():
-            if server['url'] == data['base_url']:
-                source_server = server
-                break
-        else:
-            raise RuntimeError(
-                "The server that issued this request can't be found."
-                "This is likely a bug in jupyter-share-link or "
-                "jupyter-share-link-labextension.")
-
+        current_user = self.get_current_user()
+        launcher = Launcher(current_user, self.hub_auth.api_token,
+                            deadline=self.deadline)
+        # A cached user model may predate the server: look again on a miss.
+        for fresh in (False, True):
+            source_user_data = await launcher.get_user_data(fresh=fresh)
+            for server in (source_user_data['servers'] or {}).values():
+                if server['url'] == server_base_url:
+                    return server
+        raise RuntimeError(
+            "The server that issued this request can't be found."
+            "This is likely a bug in jupyter-share-link or "
+            "jupyter-share-link-labextension.")
+
+    async def _issue(self, path, source_server, expiration_time):
+        """
+        Sign a token for path on source_server, or store it as a short link,
+        and return the link.
+        """
+        if not isinstance(path, str):
+            raise ValueError(f"path must be a string, not {path!r}")
         payload = {
-            'user': current_user['name'],
-            'path': data['path'],
+            'user': self.get_current_user()['name'],
+            'path': path,
             'opts': source_server['user_options'],
-            'exp': expiration_time
+            'exp': expiration_time,
+            'jti': secrets.token_urlsafe(9),
         }
-        token = jwt.encode(payload, private_key, algorithm="RS256")
-        base64_token = base64.urlsafe_b64encode(token)
+        snapshots = self.settings['snapshots']
+        if snapshots.enabled:
+            with span('snapshot'):
+                digest = await self._snapshot(
+                    source_server, path,
+                    calendar.timegm(expiration_time.utctimetuple()))
+            if digest is not None:
+                payload['snap'] = digest
+        short_links = self.settings['short_links']
+        if short_links.enabled:
+            with span('store'):
+                query = f'id={short_links.issue(payload)}'
+        else:
+            with span('sign'):
+                token = await self.settings['signer'].encode_link(payload)
+            query = f'token={token}'
         base_url = f'{self.request.protocol}://{self.request.host}'
         link = url_path_join(base_url,
                              os.getenv('JUPYTERHUB_SERVICE_PREFIX'),
-                             f'open?token={base64_token.decode()}')
+                             f'open?{query}')
         app_log.info("Issuing token %s", payload)
-        self.write({'link': link})
+        self.settings['warm_pool'].record_issued(payload['opts'])
+        return link
 
+    async def _snapshot(self, source_server, path, exp):
+        """
+        Copy the file at path into the snapshot store, to be kept until exp.
 
-class OpenSharedLink(HubAuthenticated, RequestHandler):
-    @authenticated
-    async def get(self):
-        unverified_base64_token = self.get_argument('token')
-        unverified_token = base64.urlsafe_b64decode(unverified_base64_token)
+        Return its digest, or None if it could not be snapshotted, in which
+        case the link reads from the sender's server instead.
+        """
+        base_url = f'{self.request.protocol}://{self.request.host}'
+        headers = {'Authorization': f'token {self.hub_auth.api_token}'}
+        if 'Cookie' in self.request.headers:
+            headers['Cookie'] = self.request.headers['Cookie']
+        writer = self.settings['snapshots'].writer()
         try:
-            token = jwt.decode(unverified_token, public_key, algorithms='RS256')
-        except jwt.exceptions.ExpiredSignatureError:
-            raise HTTPError(
-                403, "Sharing link has expired. Ask for a fresh link."
-            )
-        except jwt.exceptions.InvalidSignatureError:
+            await ContentTransfer(headers).download(
+                url_path_join(base_url, source_server['url']), path,
+                writer.write)
+        except Exception as e:
+            writer.discard()
+            app_log.warning("Not snapshotting %s: %s", path, e)
+            return None
+        return writer.commit(exp)
+
+
+class CreateSharedLinks(CreateSharedLink):
+    """
+    Issue links for several files on one server.
+
+    The request body has a list of 'paths' where /create has one 'path'.
+    The response has one entry in 'links' per path, in the same order, each
+    with either a 'link' or an 'error'.
+    """
+    max_paths = int(os.getenv('JUPYTERHUB_SHARE_LINK_MAX_BATCH', 500))
+
+    @authenticated
+    async def post(self):
+        data = json.loads(self.request.body.decode('utf-8'))
+        paths = data.get('paths')
+        if not isinstance(paths, list):
+            raise HTTPError(400, "'paths' must be a list of paths.")
+        if len(paths) > self.max_paths:
             raise HTTPError(
-                403, ("Sharing link has an invalid signature. Was it "
-                      "copy/pasted in full?")
-            )
+                400, f"At most {self.max_paths} paths may be shared at once.")
+        expiration_time = self._expiration_time(data)
+        with span('find_source'):
+            source_server = await self._find_source_server(data['base_url'])
+        # Tokens are signed on a thread pool, so issue them all at once.
+        results = await asyncio.gather(
+            *(self._issue(path, source_server, expiration_time)
+              for path in paths),
+            return_exceptions=True)
+        links = []
+        for path, result in zip(paths, results):
+            if isinstance(result, Exception):
+                app_log.error("Failed to issue a link for %s", path,
+                              exc_info=result)
+                links.append({'path': path, 'error': str(result)})
+            else:
+                links.append({'path': path, 'link': result})
+        self.write({'links': links})
+
+
+class OpenSharedLink(DeadlineHandler, TracedHandler, HubAuthenticated,
+                     RequestHandler):
+    @authenticated
+    async def get(self):
+        with span('verify'):
+            token = await link_claims(self)
         app_log.info("Honoring token %s", token)
 
         source_username = token['user']
@@ -114,8 +337,11 @@ class OpenSharedLink(HubAuthenticated, RequestHandler):
                                       os.path.basename(source_path))
 
         current_user = self.get_current_user()
-        source_launcher = Launcher({'name': source_username}, self.hub_auth.api_token)
-        target_launcher = Launcher(current_user, self.hub_auth.api_token)
+        source_launcher = Launcher({'name': source_username},
+                                   self.hub_auth.api_token, role='source',
+                                   deadline=self.deadline)
+        target_launcher = Launcher(current_user, self.hub_auth.api_token,
+                                   role='target', deadline=self.deadline)
 
         # HACK
         # The Jupyter Hub API only gives us a *relative* path to the user
@@ -125,84 +351,62 @@ class OpenSharedLink(HubAuthenticated, RequestHandler):
         if 'Cookie' in self.request.headers:
             headers['Cookie'] = self.request.headers['Cookie']
 
-        resp = await source_launcher.api_request(
-            url_path_join('users', source_username),
-            method='GET',
-        )
-        source_user_data = json.loads(resp.body.decode('utf-8'))
-
-        # Find a source server with matching user_options, or start one.
-        resp = await source_launcher.api_request(
-            url_path_join('users', source_username),
-            method='GET',
-        )
-        source_user_data = json.loads(resp.body.decode('utf-8'))
-        for server in (source_user_data['servers'] or {}).values():
-            if server['user_options'] == user_options:
-                source_server_url = server['url']
-                break
-        else:
-            # No currently-running server was spawned with the same
-            # user_options as the one shared from.
-            # Start a new server with a random name.
-            source_server_name = f'shared-link-{str(uuid.uuid4())[:8]}'
-            pending_server = await source_launcher.launch(
-                user_options, source_server_name, headers=headers)
-            assert pending_server['status'] == 'running'
-            resp = await source_launcher.api_request(
-                url_path_join('users', source_username),
-                method='GET')
-            source_server = json.loads(resp.body.decode('utf-8'))['servers'][source_server_name]
-            source_server_url = server['url']
-
-        # Ensure destination has a server to share into.
-        # First check to see if any of the currently-running servers have the
-        # same spawner user_options as the ones we need.
-        resp = await target_launcher.api_request(
-            url_path_join('users', current_user['name']),
-            method='GET',
-        )
-        dest_user_data = json.loads(resp.body.decode('utf-8'))
-        for server in (dest_user_data['servers'] or {}).values():
-            if server['user_options'] == user_options:
-                # Pull the name out specifically because we must obtain it
-                # different in the code path below.
-                target_server_name = server['name']
-                target_server = server
-                break
-        else:
-            # No currently-running server was spawned with the same
-            # user_options as the one being shared from.
-            # Start a new server with a random name.
-            target_server_name = f'shared-link-{str(uuid.uuid4())[:8]}'
-            pending_server = await target_launcher.launch(
-                user_options, target_server_name, headers=headers)
-            assert pending_server['status'] == 'running'
-            resp = await target_launcher.api_request(
-                url_path_join('users', current_user['name']),
-                method='GET')
-            target_server = json.loads(resp.body.decode('utf-8'))['servers'][target_server_name]
-
-        # Fetch the content we want to copy.
-        content_url = url_path_join(base_url,
-                                    source_server_url,
-                                    'api/contents',
-                                    source_path)
+        # Without a snapshot, or with snapshots since disabled, copy from the
+        # sender's server.
+        snapshot = None
+        snapshots = self.settings['snapshots']
+        if token.get('snap') and snapshots.enabled:
+            snapshot = snapshots.open(token['snap'])
+
+        # Find a source server and a destination server with matching
+        # user_options, starting them if necessary. Spawns can take minutes,
+        # so do both at once. A snapshot makes the source server unnecessary.
+        with span('resolve'):
+            try:
+                target_task = asyncio.ensure_future(traced(
+                    'target', target_launcher.find_or_launch(
+                        user_options, headers)))
+                if snapshot is not None:
+                    source_task = None
+                    target_server, = await gather_or_cancel(target_task)
+                else:
+                    if source_username == current_user['name']:
+                        # Sharing with oneself: one server serves as both.
+                        source_task = target_task
+                    else:
+                        source_task = asyncio.ensure_future(traced(
+                            'source', source_launcher.find_or_launch(
+                                user_options, headers)))
+                    source_server, target_server = await gather_or_cancel(
+                        source_task, target_task)
+            except BaseException:
+                # Copying closes the snapshot; if it is never reached, do so
+                # here rather than leave the file open.
+                if snapshot is not None:
+                    snapshot[0].close()
+                raise
+        warm_pool = self.settings['warm_pool']
+        if warm_pool.enabled:
+            warm_pool.claim(current_user['name'], target_server['name'])
+
+        # Copy content from the source server, or the snapshot, into the
+        # destination server.
         headers = {'Authorization': f'token {target_launcher.hub_api_token}'}
         if 'Cookie' in self.request.headers:
             headers['Cookie'] = self.request.headers['Cookie']
-        req = HTTPRequest(content_url, headers=headers)
-        resp = await AsyncHTTPClient().fetch(req)
-        content = resp.body
-
-        # Copy content into destination server.
-        to_username = target_launcher.user['name']
-        dest_url = url_path_join(base_url,
-                                 target_server['url'],
-                                 'api/contents/',
-                                 dest_path)
-        req = HTTPRequest(dest_url, "PUT", headers=headers, body=content)
-        resp = await AsyncHTTPClient().fetch(req)
+        transfer = ContentTransfer(headers)
+        target_server_url = url_path_join(base_url, target_server['url'])
+        with span('copy'):
+            if snapshot is not None:
+                file, size = snapshot
+                with file:
+                    await transfer.upload_file(
+                        file, size, target_server_url, dest_path)
+            else:
+                await transfer.copy(
+                    url_path_join(base_url, source_server['url']),
+                    source_path, target_server_url, dest_path,
+                    progress=functools.partial(self._log_progress, dest_path))
 
         redirect_url = url_path_join(target_server['url'], 'lab', 'tree', dest_path)
 
@@ -210,51 +414,166 @@ class OpenSharedLink(HubAuthenticated, RequestHandler):
         redirect_url = (redirect_url if redirect_url.startswith('/')
                         else '/' + redirect_url)
 
+        app_log.info("Opened %s:%s for %s in %.3fs (%s)",
+                     source_username, source_path, current_user['name'],
+                     self.request.request_time(), self.trace.summary())
         self.redirect(redirect_url)
 
+    @staticmethod
+    def _log_progress(dest_path, files_done, files_total,
+                      bytes_done, bytes_total):
+        "Log the progress of copying a directory, at every tenth or so."
+        step = max(files_total // 10, 1)
+        if files_done % step == 0 or files_done == files_total:
+            app_log.info("Copied %d/%d files (%d/%d bytes) into %s",
+                         files_done, files_total, bytes_done, bytes_total,
+                         dest_path)
+
+
+class RevokeSharedLink(HubAuthenticated, RequestHandler):
+    """
+    Revoke a link, so that it can no longer be opened.
+
+    The request body has the 'link'. Only the user who created it, or an
+    admin, may revoke it.
+    """
+    @authenticated
+    async def post(self):
+        data = json.loads(self.request.body.decode('utf-8'))
+        link = data.get('link')
+        if not isinstance(link, str):
+            raise HTTPError(400, "'link' must be the link to revoke.")
+        query = parse_qs(urlparse(link).query)
+        claims = await read_link(self.settings,
+                                 link_id=query.get('id', [None])[0],
+                                 token=query.get('token', [None])[0])
+        current_user = self.get_current_user()
+        is_creator = claims['user'] == current_user['name']
+        if not (is_creator or current_user.get('admin')):
+            raise HTTPError(
+                403, "Only the user who created a link may revoke it.")
+        try:
+            self.settings['revocations'].revoke(claims)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        app_log.info("%s revoked token %s", current_user['name'], claims)
+        self.write({'revoked': claims.get('jti')})
+
 
 class Info(HubAuthenticated, RequestHandler):
     version = get_versions()['version']
 
     async def get(self):
-        self.write({"version": self.version})
+        self.write({"version": self.version,
+                    "worker": task_id(),
+                    "pool": self.settings['warm_pool'].status(),
+                    "token_cache": self.settings['verified_tokens'].status(),
+                    "snapshots": self.settings['snapshots'].status(),
+                    "short_links": self.settings['short_links'].status(),
+                    "revocations": self.settings['revocations'].status(),
+                    "hub_circuit": Launcher.breaker.status(),
+                    "spawn_times": Launcher.spawn_times.status(),
+                    "http_client": HTTPClientPool.instance().status()})
 
 
 class InspectSharedLink(HubAuthenticated, RequestHandler):
     async def get(self):
-        unverified_base64_token = self.get_argument('token')
-        unverified_token = base64.urlsafe_b64decode(unverified_base64_token)
-        try:
-            token = jwt.decode(unverified_token, public_key, algorithms='RS256')
-        except jwt.exceptions.ExpiredSignatureError:
-            raise HTTPError(
-                403, "Sharing link has expired. Ask for a fresh link."
-            )
-        except jwt.exceptions.InvalidSignatureError:
-            raise HTTPError(
-                403, ("Sharing link has an invalid signature. Was it "
-                      "copy/pasted in full?")
-            )
+        token = await link_claims(self)
         self.write({'token': token})
 
 
-def main():
-    app = Application(
+def make_app(**settings):
+    """
+    Return the service's Application.
+
+    Shared state that is not passed in settings (the signer, caches, warm
+    pool, snapshot and short link stores, revocations and trace exporter) is
+    created from the environment.
+    Call this in each worker process, after forking.
+    """
+    prefix = os.environ['JUPYTERHUB_SERVICE_PREFIX']
+    if 'signer' not in settings:
+        settings['signer'] = load_signer()
+    if 'verified_tokens' not in settings:
+        settings['verified_tokens'] = VerifiedTokenCache()
+    if 'warm_pool' not in settings:
+        settings['warm_pool'] = WarmPool(os.environ['JUPYTERHUB_API_TOKEN'])
+    if 'snapshots' not in settings:
+        settings['snapshots'] = SnapshotStore()
+    if 'short_links' not in settings:
+        settings['short_links'] = ShortLinkStore()
+    if 'revocations' not in settings:
+        settings['revocations'] = RevocationList()
+    if 'trace_exporter' not in settings:
+        settings['trace_exporter'] = load_exporter()
+    settings.setdefault('log_function', log_request)
+    return Application(
         [
-            (os.environ['JUPYTERHUB_SERVICE_PREFIX'] + r'create/?', CreateSharedLink),
-            (os.environ['JUPYTERHUB_SERVICE_PREFIX'] + r'open/?', OpenSharedLink),
-            (os.environ['JUPYTERHUB_SERVICE_PREFIX'] + r'inspect/?', InspectSharedLink),
-            (os.environ['JUPYTERHUB_SERVICE_PREFIX'] + r'/?', Info),
-        ]
+            (prefix + r'create/?', CreateSharedLink),
+            (prefix + r'create/batch/?', CreateSharedLinks),
+            (prefix + r'open/?', OpenSharedLink),
+            (prefix + r'inspect/?', InspectSharedLink),
+            (prefix + r'revoke/?', RevokeSharedLink),
+            (prefix + r'metrics/?', MetricsHandler),
+            (prefix + r'/?', Info),
+        ],
+        **settings,
     )
 
-    http_server = HTTPServer(app)
-    url = urlparse(os.environ['JUPYTERHUB_SERVICE_URL'])
 
-    http_server.listen(url.port, url.hostname)
-    tornado.options.parse_command_line(sys.argv)
+def _stop_if_orphaned(parent):
+    if os.getppid() != parent:
+        app_log.info("Parent process %d has exited; stopping worker", parent)
+        IOLoop.current().stop()
 
+
+def main():
+    tornado.options.parse_command_line(sys.argv)
+    url = urlparse(os.environ['JUPYTERHUB_SERVICE_URL'])
+    sockets = bind_sockets(url.port, url.hostname)
+    # Opening the store clears out snapshots left half-written by a previous
+    # run, so do it once, before there are workers writing snapshots.
+    snapshots = SnapshotStore()
+    workers = int(os.getenv('JUPYTERHUB_SHARE_LINK_WORKERS', 1))
+    parent = os.getpid()
+    if workers != 1:
+        if multiprocess_dir() is None:
+            app_log.warning("PROMETHEUS_MULTIPROC_DIR is not set, so each "
+                            "worker serves only its own metrics")
+        else:
+            clear_multiprocess_dir()
+        if not RevocationList.path:
+            app_log.warning("JUPYTERHUB_SHARE_LINK_REVOCATION_STORE is not "
+                            "set, so each worker refuses only the links it "
+                            "revoked itself")
+        # Each worker accepts connections on the sockets bound above, and
+        # has its own caches and warm pool.
+        fork_processes(workers)
+
+    app = make_app(snapshots=snapshots)
+    http_server = HTTPServer(app)
+    http_server.add_sockets(sockets)
+
+    if workers != 1:
+        # The Hub stops the service by signalling the parent process only.
+        PeriodicCallback(functools.partial(_stop_if_orphaned, parent),
+                         1000).start()
+
+    warm_pool = app.settings['warm_pool']
+    if warm_pool.enabled:
+        PeriodicCallback(warm_pool.schedule_refill, 60 * 1000).start()
+    if snapshots.enabled:
+        PeriodicCallback(snapshots.refresh, 5 * 60 * 1000).start()
+    revocations = app.settings['revocations']
+    if revocations.persistent:
+        PeriodicCallback(revocations.refresh,
+                         revocations.refresh_interval * 1000).start()
+    PeriodicCallback(revocations.purge, 5 * 60 * 1000).start()
+    short_links = app.settings['short_links']
+    if short_links.enabled:
+        PeriodicCallback(short_links.schedule_purge, 5 * 60 * 1000).start()
     IOLoop.current().start()
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Short links: an 8-character id in place of a signed token.
+
+With a store configured, /create saves the claims of a link in a local
+SQLite database under a random id and returns open?id=<id>. Opening the link
+looks the claims up by id, so no signature is made or checked. Rows are
+indexed by expiry and purged in batches once their links have expired.
+"""
+import asyncio
+import calendar
+from collections import Counter, OrderedDict
+from datetime import datetime
+import json
+import os
+import secrets
+import sqlite3
+import time
+
+from tornado.log import app_log
+
+
+class ShortLinkStore():
+    """
+    Claims of short links, in SQLite, fronted by an in-memory LRU cache.
+
+    The database is a file that several worker processes may share; each
+    has its own cache. Links are unguessable: ids are 48 random bits.
+    """
+
+    path = os.getenv('JUPYTERHUB_SHARE_LINK_ID_STORE')
+    cache_size = int(os.getenv('JUPYTERHUB_SHARE_LINK_ID_CACHE_SIZE', 4096))
+    purge_batch = 1000
+
+    def __init__(self, path=None):
+        if path is not None:
+            self.path = path
+        self._cache = OrderedDict()  # id -> claims
+        self.stats = Counter(hits=0, misses=0, issued=0, purged=0)
+        self._purging = None
+        self._db = None
+        if self.enabled:
+            self._db = sqlite3.connect(self.path, isolation_level=None)
+            # Readers do not block the writer, and commits need not wait for
+            # the disk, which suits many small inserts.
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS links ('
+                             'id TEXT PRIMARY KEY, claims TEXT NOT NULL, '
+                             'exp REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS links_exp '
+                             'ON links (exp)')
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _remember(self, link_id, claims):
+        if self.cache_size <= 0:
+            return
+        self._cache[link_id] = claims
+        self._cache.move_to_end(link_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def issue(self, claims):
+        "Store claims, which must include 'exp', and return their new id."
+        claims = dict(claims)
+        if isinstance(claims['exp'], datetime):
+            claims['exp'] = calendar.timegm(claims['exp'].utctimetuple())
+        data = json.dumps(claims, separators=(',', ':'))
+        while True:
+            link_id = secrets.token_urlsafe(6)
+            try:
+                self._db.execute(
+                    'INSERT INTO links (id, claims, exp) VALUES (?, ?, ?)',
+                    (link_id, data, claims['exp']))
+            except sqlite3.IntegrityError:
+                continue  # The id is taken; draw another.
+            break
+        self.stats['issued'] += 1
+        self._remember(link_id, claims)
+        return link_id
+
+    def get(self, link_id):
+        """
+        Return the claims of the link with link_id, or None if there is no
+        such link. Expired links are returned: the caller checks 'exp'.
+        """
+        claims = self._cache.get(link_id)
+        if claims is not None:
+            self._cache.move_to_end(link_id)
+            self.stats['hits'] += 1
+            return claims
+        self.stats['misses'] += 1
+        row = self._db.execute('SELECT claims FROM links WHERE id = ?',
+                               (link_id,)).fetchone()
+        if row is None:
+            return None
+        claims = json.loads(row[0])
+        self._remember(link_id, claims)
+        return claims
+
+    def schedule_purge(self):
+        "Start purging expired links in the background, unless doing so."
+        if self._purging is not None and not self._purging.done():
+            return
+        self._purging = asyncio.ensure_future(self.purge())
+        self._purging.add_done_callback(self._log_purge_error)
+
+    @staticmethod
+    def _log_purge_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            app_log.error("Failed to purge expired short links",
+                          exc_info=future.exception())
+
+    async def purge(self):
+        """
+        Delete expired links, purge_batch rows at a time, yielding to other
+        requests between batches.
+        """
+        now = time.time()
+        for link_id, claims in list(self._cache.items()):
+            if claims['exp'] <= now:
+                del self._cache[link_id]
+        while True:
+            deleted = self._db.execute(
+                'DELETE FROM links WHERE id IN (SELECT id FROM links '
+                'WHERE exp <= ? LIMIT ?)', (now, self.purge_batch)).rowcount
+            self.stats['purged'] += deleted
+            if deleted < self.purge_batch:
+                return
+            await asyncio.sleep(0)
+
+    def status(self):
+        "Return a summary of the store for reporting."
+        return {'enabled': self.enabled,
+                'cached': len(self._cache),
+                **self.stats}
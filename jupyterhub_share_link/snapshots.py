@@ -0,0 +1,205 @@
+"""
+A content-addressed store of files snapshotted when links are created.
+
+Opening a link normally means reading the file from the sender's server,
+spawning one for them if they have logged off. With snapshots enabled, the
+file is copied into the service's own store when the link is created and
+read from there when it is opened.
+"""
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import time
+
+from tornado.log import app_log
+
+
+def _unlink(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SnapshotWriter():
+    "Write one snapshot into a temporary file while hashing it."
+
+    def __init__(self, store):
+        self.store = store
+        self._hash = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(
+            dir=store.directory, prefix='.incoming-', delete=False)
+        self.size = 0
+
+    def write(self, chunk):
+        self._hash.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self, exp):
+        """
+        Move the snapshot into the store, to be kept until at least exp.
+
+        Return its digest, which names it in the store.
+        """
+        self._file.close()
+        digest = self._hash.hexdigest()
+        self.store._add(digest, pathlib.Path(self._file.name), self.size, exp)
+        return digest
+
+    def discard(self):
+        self._file.close()
+        _unlink(pathlib.Path(self._file.name))
+
+
+class SnapshotStore():
+    """
+    Snapshots on local disk, named by the SHA-256 digest of their content.
+
+    Each snapshot is kept until the last token that refers to it expires.
+    When the store exceeds max_bytes, the least recently used snapshots are
+    removed first; links to them fall back to reading the sender's server.
+
+    Several worker processes may share one directory. Each keeps an index of
+    the snapshots it knows of, which refresh() brings up to date.
+    """
+
+    directory = os.getenv('JUPYTERHUB_SHARE_LINK_SNAPSHOT_DIR')
+    max_bytes = int(os.getenv('JUPYTERHUB_SHARE_LINK_SNAPSHOT_MAX_BYTES',
+                              10 * 1024 ** 3))
+
+    def __init__(self, directory=None):
+        if directory is not None:
+            self.directory = directory
+        self._index = {}  # digest -> {'size': ..., 'exp': ...}
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def _path(self, digest):
+        return pathlib.Path(self.directory, digest)
+
+    def _meta_path(self, digest):
+        return pathlib.Path(self.directory, f'{digest}.json')
+
+    def _read_meta(self, digest):
+        try:
+            return json.loads(self._meta_path(digest).read_text())
+        except FileNotFoundError:
+            return None
+
+    def _scan(self):
+        "Return the index of the snapshots on disk."
+        index = {}
+        for meta_path in pathlib.Path(self.directory).glob('*.json'):
+            digest = meta_path.stem
+            if self._path(digest).exists():
+                meta = self._read_meta(digest)
+                if meta is not None:
+                    index[digest] = meta
+        return index
+
+    def _load_index(self):
+        self._index = self._scan()
+        for meta_path in pathlib.Path(self.directory).glob('*.json'):
+            if meta_path.stem not in self._index:
+                _unlink(meta_path)
+        for incoming in pathlib.Path(self.directory).glob('.incoming-*'):
+            incoming.unlink()
+
+    def writer(self):
+        "Return a SnapshotWriter for a new snapshot."
+        return SnapshotWriter(self)
+
+    def _add(self, digest, temp_path, size, exp):
+        meta = self._index.get(digest)
+        if meta is None:
+            os.replace(temp_path, self._path(digest))
+            meta = {'size': size, 'exp': exp}
+        else:
+            # The same content is already stored; keep it long enough for
+            # this token too.
+            temp_path.unlink()
+            meta['exp'] = max(meta['exp'], exp)
+        self._index[digest] = meta
+        self._meta_path(digest).write_text(json.dumps(meta))
+        self.purge()
+
+    def open(self, digest):
+        """
+        Return (file, size) for the snapshot named digest, or None if it is
+        not in the store.
+        """
+        if not self.enabled:
+            return None
+        meta = self._index.get(digest)
+        if meta is None:
+            # Another worker process may have written it.
+            meta = self._read_meta(digest)
+            if meta is None:
+                return None
+            self._index[digest] = meta
+        path = self._path(digest)
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            self._index.pop(digest, None)
+            return None
+        # The modification time records when the snapshot was last used.
+        os.utime(path)
+        return file, meta['size']
+
+    def total_bytes(self):
+        return sum(meta['size'] for meta in self._index.values())
+
+    def purge(self):
+        """
+        Remove expired snapshots, then the least recently used ones until the
+        store fits in max_bytes.
+        """
+        now = time.time()
+        for digest, meta in list(self._index.items()):
+            if meta['exp'] <= now:
+                self._remove(digest)
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        by_last_use = sorted(self._index, key=self._last_used)
+        for digest in by_last_use:
+            if total <= self.max_bytes:
+                break
+            total -= self._index[digest]['size']
+            app_log.info("Evicting snapshot %s to stay within %d bytes",
+                         digest, self.max_bytes)
+            self._remove(digest)
+
+    def refresh(self):
+        """
+        Reload the index from disk, where other worker processes may have
+        added or removed snapshots, and purge.
+        """
+        self._index = self._scan()
+        self.purge()
+
+    def _last_used(self, digest):
+        try:
+            return self._path(digest).stat().st_mtime
+        except FileNotFoundError:
+            return 0
+
+    def _remove(self, digest):
+        del self._index[digest]
+        _unlink(self._path(digest))
+        _unlink(self._meta_path(digest))
+
+    def status(self):
+        "Return a summary of the store for reporting."
+        return {'enabled': self.enabled,
+                'snapshots': len(self._index),
+                'bytes': self.total_bytes()}
@@ -0,0 +1,85 @@
+import asyncio
+
+from prometheus_client import REGISTRY
+import pytest
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application, RequestHandler
+
+from ..clients import HTTPClientPool
+
+
+def test_http_client_pool_limits_each_host():
+    "Requests beyond max_per_host wait, and their wait is measured."
+    active = []
+    peak = []
+
+    class Slow(RequestHandler):
+        async def get(self):
+            active.append(None)
+            peak.append(len(active))
+            await asyncio.sleep(0.02)
+            active.pop()
+            self.write('ok')
+
+    async def run():
+        sock, port = bind_unused_port()
+        server = HTTPServer(Application([(r'/', Slow)]))
+        server.add_sockets([sock])
+        try:
+            pool = HTTPClientPool()
+            pool.max_per_host = 2
+            await asyncio.gather(*(
+                pool.fetch(HTTPRequest(f'http://127.0.0.1:{port}/'))
+                for _ in range(6)))
+            return pool.status()
+        finally:
+            server.stop()
+
+    def waits():
+        return REGISTRY.get_sample_value(
+            'share_link_http_client_wait_seconds_count') or 0
+
+    before = waits()
+    status = asyncio.run(run())
+    assert waits() == before + 6
+    assert REGISTRY.get_sample_value('share_link_http_client_active') == 0
+    assert max(peak) == 2
+    assert status['requests'] == 6
+    assert status['queued'] == 0
+    assert status['wait_time_max'] > 0.01
+
+
+def test_curl_client_honours_max_body_size(monkeypatch):
+    "Tornado's 100 MB cap on response bodies is lifted for curl too."
+    pytest.importorskip('pycurl')
+
+    class Body(RequestHandler):
+        def get(self):
+            self.write(b'x' * 1000)
+
+    async def run(max_body_size):
+        monkeypatch.setattr(HTTPClientPool, '_configured', None)
+        monkeypatch.setattr(HTTPClientPool, 'implementation', 'curl')
+        monkeypatch.setattr(HTTPClientPool, 'max_body_size', max_body_size)
+        sock, port = bind_unused_port()
+        server = HTTPServer(Application([(r'/', Body)]))
+        server.add_sockets([sock])
+        try:
+            pool = HTTPClientPool()
+            assert pool.status()['implementation'] == 'curl'
+            assert pool.client.max_body_size == max_body_size
+            return await pool.fetch(HTTPRequest(f'http://127.0.0.1:{port}/'))
+        finally:
+            pool.client.close()
+            server.stop()
+
+    saved = AsyncHTTPClient._save_configuration()
+    try:
+        assert len(asyncio.run(run(64 * 1024 ** 3)).body) == 1000
+        with pytest.raises(HTTPClientError) as excinfo:
+            asyncio.run(run(100))
+        assert 'max_body_size' in str(excinfo.value)
+    finally:
+        AsyncHTTPClient._restore_configuration(saved)
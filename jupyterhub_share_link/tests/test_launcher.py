@@ -0,0 +1,321 @@
+import asyncio
+import itertools
+import json
+import time
+
+import pytest
+from tornado.httpclient import HTTPClientError
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application, HTTPError, RequestHandler
+
+from ..launcher import (CircuitBreaker, HubUnavailable, Launcher,
+                        RetryPolicy, SpawnTimes, UserModelCache)
+
+
+def test_user_model_cache_coalesces_and_expires():
+    "Concurrent lookups share one fetch; lookups after the TTL refetch."
+    calls = []
+
+    async def fetch():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return {'name': 'alice', 'n': len(calls)}
+
+    async def run():
+        cache = UserModelCache(ttl=0.05, max_size=8)
+        models = await asyncio.gather(*(cache.get('alice', fetch)
+                                        for _ in range(10)))
+        assert len(calls) == 1
+        assert all(model['n'] == 1 for model in models)
+        assert (await cache.get('alice', fetch))['n'] == 1
+        await asyncio.sleep(0.06)
+        assert (await cache.get('alice', fetch))['n'] == 2
+
+    asyncio.run(run())
+
+
+def test_user_model_cache_invalidate_and_lru():
+    "Invalidation forces a refetch; the least recently used entry is evicted."
+    calls = []
+
+    def fetcher(name):
+        async def fetch():
+            calls.append(name)
+            return {'name': name}
+        return fetch
+
+    async def run():
+        cache = UserModelCache(ttl=60, max_size=2)
+        await cache.get('alice', fetcher('alice'))
+        cache.invalidate('alice')
+        await cache.get('alice', fetcher('alice'))
+        assert calls == ['alice', 'alice']
+        await cache.get('bob', fetcher('bob'))
+        await cache.get('alice', fetcher('alice'))  # alice is now most recent
+        await cache.get('carol', fetcher('carol'))  # evicts bob
+        await cache.get('alice', fetcher('alice'))
+        await cache.get('bob', fetcher('bob'))
+        assert calls == ['alice', 'alice', 'bob', 'carol', 'bob']
+
+    asyncio.run(run())
+
+
+class FakeHub():
+    "Just enough of the Hub API to follow one server's spawn."
+    def __init__(self, progress=True, failures=0):
+        self.progress = progress
+        self.failures = failures
+        self.polls = 0
+        self.ready_after = 3
+
+    def app(self):
+        hub = self
+
+        class Progress(RequestHandler):
+            async def get(self, name, server):
+                if not hub.progress:
+                    raise HTTPError(404)
+                if hub.progress == 'hang':
+                    await asyncio.sleep(10)
+                self.set_header('Content-Type', 'text/event-stream')
+                for event in ({'progress': 50, 'message': 'Starting'},
+                              {'progress': 100, 'ready': True,
+                               'url': f'/user/{name}/{server}/'}):
+                    self.write(f'data: {json.dumps(event)}\n\n')
+                    await self.flush()
+
+        class User(RequestHandler):
+            def get(self, name):
+                if hub.failures:
+                    hub.failures -= 1
+                    raise HTTPError(503)
+                hub.polls += 1
+                ready = hub.polls >= hub.ready_after
+                self.write({'name': name, 'servers': {'s': {
+                    'name': 's', 'url': f'/user/{name}/s/',
+                    'ready': ready, 'pending': None if ready else 'spawn'}}})
+
+        return Application([
+            (r'/hub/api/users/([^/]+)/servers/([^/]+)/progress', Progress),
+            (r'/hub/api/users/([^/]+)', User),
+        ])
+
+
+def with_hub(hub, monkeypatch, func):
+    "Run func(launcher) against hub."
+    async def run():
+        sock, port = bind_unused_port()
+        server = HTTPServer(hub.app())
+        server.add_sockets([sock])
+        monkeypatch.setenv('JUPYTERHUB_API_URL',
+                           f'http://127.0.0.1:{port}/hub/api')
+        monkeypatch.setattr(Launcher, 'breaker', CircuitBreaker())
+        try:
+            return await func(Launcher({'name': 'alice'}, 'secret'))
+        finally:
+            server.stop()
+            Launcher.user_cache.clear()
+
+    return asyncio.run(run())
+
+
+def wait_for_ready(hub, monkeypatch):
+    async def wait(launcher):
+        launcher.poll_interval_min = 0.01
+        return await launcher.wait_for_ready('s', {})
+
+    return with_hub(hub, monkeypatch, wait)
+
+
+def test_wait_for_ready_follows_progress_stream(monkeypatch):
+    hub = FakeHub()
+    assert wait_for_ready(hub, monkeypatch)['url'] == '/user/alice/s/'
+    assert hub.polls == 0
+
+
+def test_wait_for_ready_falls_back_to_polling(monkeypatch):
+    hub = FakeHub(progress=False)
+    assert wait_for_ready(hub, monkeypatch)['url'] == '/user/alice/s/'
+    assert hub.polls == 3
+
+
+def test_concurrent_launches_are_coalesced(monkeypatch):
+    "Concurrent requests for the same user and options share one spawn."
+    servers = {}
+
+    async def launch(self, user_options, server_name, headers):
+        await asyncio.sleep(0.01)
+        servers[server_name] = {'name': server_name,
+                                'user_options': user_options,
+                                'url': f'/user/alice/{server_name}/'}
+        return {'status': 'running'}
+
+    async def get_user_data(self, fresh=False):
+        return {'servers': dict(servers)}
+
+    monkeypatch.setattr(Launcher, 'launch', launch)
+    monkeypatch.setattr(Launcher, 'get_user_data', get_user_data)
+
+    async def run():
+        launchers = [Launcher({'name': 'alice'}, 'secret') for _ in range(5)]
+        found = await asyncio.gather(
+            *(launcher.find_or_launch({'image': 'a', 'cpu': 1}, {})
+              for launcher in launchers),
+            launchers[0].find_or_launch({'cpu': 1, 'image': 'a'}, {}),
+            launchers[0].find_or_launch({'image': 'b'}, {}))
+        assert len({server['name'] for server in found[:6]}) == 1
+        assert found[6]['name'] != found[0]['name']
+        assert len(servers) == 2
+        assert not Launcher.pending_launches
+
+    asyncio.run(run())
+
+
+def test_retry_delays_are_jittered_and_capped():
+    policy = RetryPolicy(attempts=10, budget=10, base_delay=0.1, max_delay=1)
+    delays = list(itertools.islice(policy.delays(), 100))
+    assert all(0.1 <= delay <= 1 for delay in delays)
+    assert len(set(delays)) > 1
+    assert max(delays) == 1
+
+
+def test_api_request_retries_errors(monkeypatch):
+    hub = FakeHub(failures=2)
+
+    async def get_user_data(launcher):
+        launcher.idempotent_retry = RetryPolicy(
+            attempts=3, budget=10, base_delay=0.01, max_delay=0.01)
+        return await launcher.get_user_data()
+
+    assert with_hub(hub, monkeypatch, get_user_data)['name'] == 'alice'
+    assert hub.failures == 0
+
+
+@pytest.mark.parametrize('budget, deadline', [(0.2, 10), (10, 0.2)])
+def test_api_request_gives_up_in_time(monkeypatch, budget, deadline):
+    "Retries stop at the policy's budget or the caller's deadline."
+    hub = FakeHub(failures=float('inf'))
+
+    async def get_user_data(launcher):
+        launcher.idempotent_retry = RetryPolicy(
+            attempts=1000, budget=budget, base_delay=0.01, max_delay=0.05)
+        launcher.breaker.threshold = 0
+        launcher.deadline = time.monotonic() + deadline
+        started = time.monotonic()
+        with pytest.raises(HTTPClientError) as excinfo:
+            await launcher.get_user_data()
+        return excinfo.value.code, time.monotonic() - started
+
+    code, elapsed = with_hub(hub, monkeypatch, get_user_data)
+    # The last attempt may have been cut short, and timed out, to finish in
+    # time.
+    assert code in (503, 599)
+    assert elapsed < 0.3
+
+
+def test_circuit_breaker_opens_and_probes():
+    breaker = CircuitBreaker()
+    breaker.min_requests = 4
+    breaker.cooldown = 0.05
+
+    def call(code=None):
+        with breaker.guard():
+            if code is not None:
+                raise HTTPClientError(code)
+
+    call()
+    for code in (404, 404, 502, 599):  # A 404 is not the Hub's fault.
+        with pytest.raises(HTTPClientError):
+            call(code)
+        assert breaker.state == 'closed'
+    with pytest.raises(HTTPClientError):
+        call(503)
+    assert breaker.state == 'open'
+    with pytest.raises(HubUnavailable) as excinfo:
+        call()
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.retry_after == 1
+
+    time.sleep(0.05)
+    assert breaker.state == 'half-open'
+    with breaker.guard():
+        # Only one probe at a time.
+        with pytest.raises(HubUnavailable):
+            call()
+        assert breaker.status()['retry_after'] == 1
+    assert breaker.state == 'closed'
+    assert breaker.status() == {
+        'enabled': True, 'state': 'closed', 'requests': 0, 'failures': 0,
+        'retry_after': None, 'opened': 1, 'rejected': 2}
+
+
+def test_open_circuit_fails_fast(monkeypatch):
+    hub = FakeHub(failures=float('inf'))
+
+    async def get_user_data(launcher):
+        launcher.breaker.min_requests = 3
+        launcher.idempotent_retry = RetryPolicy(
+            attempts=10, budget=10, base_delay=0.01, max_delay=0.01)
+        with pytest.raises(HubUnavailable):
+            await launcher.get_user_data()
+        with pytest.raises(HubUnavailable):
+            await launcher.get_user_data()
+
+    with_hub(hub, monkeypatch, get_user_data)
+    assert hub.failures == float('inf')
+
+
+def test_spawn_times_estimate_recent_spawns():
+    spawn_times = SpawnTimes(size=10, max_options=1)
+    for duration in range(1, 5):
+        spawn_times.record({'image': 'a'}, duration)
+    assert spawn_times.estimate({'image': 'a'}) is None
+    for duration in range(5, 21):
+        spawn_times.record({'image': 'a'}, duration)
+    # Only the last ten are kept.
+    assert spawn_times.estimate({'image': 'a'}) == {
+        'samples': 10, 'p10': 11, 'p50': 15, 'p90': 19}
+    assert list(spawn_times.estimates()) == ['{"image":"a"}']
+    spawn_times.record({'image': 'b'}, 1)
+    assert spawn_times.estimates() == {}
+    assert spawn_times.status() == {'options': 1, 'estimated': 0,
+                                    'samples': 1}
+
+
+def test_poll_intervals_follow_spawn_history(monkeypatch):
+    "Polls follow the percentiles of recent spawn times."
+    monkeypatch.setattr(Launcher, 'spawn_times', SpawnTimes(size=50))
+    launcher = Launcher({'name': 'alice'}, 'secret')
+    options = {'image': 'a'}
+    default = list(itertools.islice(launcher._poll_intervals(options), 3))
+    assert default == pytest.approx([0.5, 0.65, 0.845])
+
+    for duration in range(40, 61):
+        launcher.spawn_times.record(options, duration)
+    polls = list(itertools.accumulate(
+        itertools.islice(launcher._poll_intervals(options, elapsed=2), 20),
+        initial=2))
+    # Seldom until the 10th percentile, 42s, then at percentiles up to the
+    # 90th, 58s.
+    assert polls[:12] == [2, 32, 42, 43, 45, 47, 49, 51, 53, 55, 57, 58]
+    # Past the 90th percentile, back off.
+    assert polls[13] - polls[12] > polls[12] - polls[11]
+
+
+def test_spawn_timeout_covers_stream_and_polling(monkeypatch):
+    "Polling after the progress stream times out does not restart the clock."
+    hub = FakeHub(progress='hang')
+    hub.ready_after = float('inf')
+
+    async def wait(launcher):
+        launcher.spawn_timeout = 0.3
+        launcher.poll_interval_min = 0.01
+        started = time.monotonic()
+        with pytest.raises(HTTPError) as excinfo:
+            await launcher.wait_for_ready('s', {}, started)
+        return excinfo.value, time.monotonic() - started
+
+    error, elapsed = with_hub(hub, monkeypatch, wait)
+    assert 'took too long' in error.log_message
+    assert elapsed < 0.5
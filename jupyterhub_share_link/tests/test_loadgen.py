@@ -0,0 +1,54 @@
+import asyncio
+import csv
+import io
+import json
+
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application, RequestHandler
+
+from ..loadgen import _main, parse_args, write_records
+
+
+class Create(RequestHandler):
+    def post(self):
+        data = json.loads(self.request.body)
+        self.write({'link': f'http://example.org/open?token={data["path"]}'})
+
+
+class Open(RequestHandler):
+    def get(self):
+        user = self.request.headers['Authorization'].split()[-1]
+        self.settings['opened'].append((user, self.get_argument('token')))
+        self.redirect('/user/lab')
+
+
+def test_classroom_opens_one_link_as_every_recipient():
+    opened = []
+
+    async def run():
+        sock, port = bind_unused_port()
+        server = HTTPServer(Application(
+            [(r'/svc/create', Create), (r'/svc/open', Open)], opened=opened))
+        server.add_sockets([sock])
+        try:
+            args = parse_args([
+                'classroom', '--url', f'http://127.0.0.1:{port}/svc',
+                '--sender-token', 'teacher', '--base-url', '/user/teacher/',
+                '--path', 'lesson.ipynb', '--recipient-token', 'a',
+                '--recipient-token', 'b', '--requests', '6', '--rate', '200'])
+            return await _main(args)
+        finally:
+            server.stop()
+
+    generator = asyncio.run(run())
+    assert sorted(opened) == [('a', 'lesson.ipynb')] * 3 + [
+        ('b', 'lesson.ipynb')] * 3
+    summary = generator.summary()
+    assert summary['create']['requests'] == 1
+    assert summary['open'] == {**summary['open'], 'requests': 6, 'errors': 0}
+
+    file = io.StringIO()
+    write_records(generator.records, file, 'csv')
+    rows = list(csv.DictReader(io.StringIO(file.getvalue())))
+    assert [row['status'] for row in rows] == ['200'] + ['302'] * 6
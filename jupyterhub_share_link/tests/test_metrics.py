@@ -0,0 +1,93 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+from jupyterhub.services.auth import HubAuthenticated
+from prometheus_client import REGISTRY
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application, HTTPError, RequestHandler
+
+from ..metrics import MetricsHandler, log_request
+
+
+def test_errors_are_counted_and_served(monkeypatch):
+    "Error responses are counted by handler and code, and /metrics serves them."
+    monkeypatch.setattr(MetricsHandler, 'authenticate', False)
+
+    class Missing(RequestHandler):
+        def get(self):
+            raise HTTPError(404)
+
+    def errors():
+        return REGISTRY.get_sample_value(
+            'share_link_errors_total', {'handler': 'Missing', 'code': '404'})
+
+    async def run():
+        sock, port = bind_unused_port()
+        app = Application([(r'/missing', Missing),
+                           (r'/metrics', MetricsHandler)],
+                          log_function=log_request)
+        server = HTTPServer(app)
+        server.add_sockets([sock])
+        client = AsyncHTTPClient(force_instance=True)
+        try:
+            for _ in range(2):
+                await client.fetch(f'http://127.0.0.1:{port}/missing',
+                                   raise_error=False)
+            resp = await client.fetch(f'http://127.0.0.1:{port}/metrics')
+            return resp.body.decode()
+        finally:
+            client.close()
+            server.stop()
+
+    before = errors() or 0
+    body = asyncio.run(run())
+    assert errors() == before + 2
+    assert 'share_link_request_duration_seconds_bucket' in body
+    assert 'share_link_errors_total{code="404",handler="Missing"}' in body
+
+
+def test_workers_share_metrics_through_a_directory(tmp_path):
+    "In multiprocess mode, /metrics counts for every worker process."
+    script = """
+import os
+from prometheus_client import generate_latest
+from jupyterhub_share_link import metrics
+
+metrics.clear_multiprocess_dir()
+pid = os.fork()
+metrics.HUB_API_RETRIES.inc()
+if pid == 0:
+    os._exit(0)
+os.waitpid(pid, 0)
+print(generate_latest(metrics.registry()).decode())
+"""
+    (tmp_path / 'counter_1.db').write_bytes(b'left by an old worker')
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    out = subprocess.run([sys.executable, '-c', script], env=env, check=True,
+                         capture_output=True, text=True).stdout
+    assert 'share_link_hub_api_retries_total 2.0' in out
+
+
+def test_metrics_require_authentication(monkeypatch):
+    users = iter([None, {'name': 'prometheus', 'kind': 'service'}])
+    monkeypatch.setattr(HubAuthenticated, 'get_current_user',
+                        lambda self: next(users))
+
+    async def run():
+        sock, port = bind_unused_port()
+        server = HTTPServer(Application([(r'/metrics', MetricsHandler)]))
+        server.add_sockets([sock])
+        client = AsyncHTTPClient(force_instance=True)
+        try:
+            return [(await client.fetch(f'http://127.0.0.1:{port}/metrics',
+                                        raise_error=False)).code
+                    for _ in range(2)]
+        finally:
+            client.close()
+            server.stop()
+
+    assert asyncio.run(run()) == [403, 200]
@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+from ..launcher import canonical_options
+from ..pool import WarmPool
+
+
+def test_warm_pool_counts_hits_and_misses():
+    pool = WarmPool(api_token='secret')
+    pool.record_issued({'image': 'a'})
+    pool.record_issued({'image': 'a'})
+    pool.record_issued({'image': 'b'})
+    key = canonical_options({'image': 'a'})
+    assert pool.popularity.most_common(1) == [(key, 2)]
+    pool.idle[('bob', 'shared-link-1')] = (key, 0)
+    assert pool.claim('bob', 'shared-link-1')
+    assert not pool.claim('bob', 'shared-link-1')
+    assert pool.status() == {'size': 0, 'idle': 0, 'hits': 1, 'misses': 1,
+                             'spawned': 0, 'evicted': 0, 'expired': 0,
+                             'failed': 0}
+
+
+def test_warm_pool_keeps_new_options_when_full():
+    "New options displace the stalest of the least popular, not themselves."
+    pool = WarmPool(api_token='secret')
+    pool.max_tracked_options = 3
+    for image in 'abc':
+        pool.record_issued({'image': image})
+    pool.record_issued({'image': 'a'})
+    pool.record_issued({'image': 'd'})
+    pool.record_issued({'image': 'd'})
+    assert set(pool.popularity) == set(pool.options) == {
+        canonical_options({'image': image}) for image in 'acd'}
+    key = canonical_options({'image': 'd'})
+    assert pool.popularity[key] == 2
+
+
+def test_warm_pool_evicts_least_popular_unwanted_server():
+    pool = WarmPool(api_token='secret')
+    for image, count in (('a', 3), ('b', 2), ('c', 1)):
+        for _ in range(count):
+            pool.record_issued({'image': image})
+    a, b, c = (canonical_options({'image': image}) for image in 'abc')
+    pool.idle = {('u', 'old-b'): (b, 1), ('u', 'new-c'): (c, 2),
+                 ('u', 'a'): (a, 0)}
+    stopped = []
+
+    async def stop(member):
+        stopped.append(member)
+        del pool.idle[member]
+
+    pool._stop = stop
+    assert asyncio.run(pool.evict(wanted=[a]))
+    assert stopped == [('u', 'new-c')]
+    pool.eviction = 'oldest'
+    assert asyncio.run(pool.evict(wanted=[a]))
+    assert stopped == [('u', 'new-c'), ('u', 'old-b')]
+    assert not asyncio.run(pool.evict(wanted=[a]))
+
+
+def test_warm_pool_skips_recipients_whose_spawns_fail():
+    "One recipient's failing spawn does not stop the pool filling."
+    pool = WarmPool(api_token='secret')
+    pool.record_issued({'image': 'a'})
+    pool.size = 4
+    pool.recipients.update({'bob': time.monotonic(),
+                            'carol': time.monotonic()})
+    spawned = []
+
+    async def cull():
+        pass
+
+    async def spawn(username, key):
+        spawned.append(username)
+        if username == 'carol':
+            raise RuntimeError("Too many servers")
+        pool.idle[(username, 'shared-link-1')] = (key, 0)
+
+    pool.cull = cull
+    pool._spawn = spawn
+    asyncio.run(pool.refill())
+    assert spawned == ['carol', 'bob']
+    assert list(pool.failed) == ['carol']
+    assert pool.stats['failed'] == 1
+    # Carol is left out until failure_backoff has passed.
+    pool.idle.clear()
+    asyncio.run(pool.refill())
+    assert spawned == ['carol', 'bob', 'bob']
+    pool.failure_backoff = 0
+    asyncio.run(pool.refill())
+    assert spawned[-1] == 'carol'
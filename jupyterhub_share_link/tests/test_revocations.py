@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from ..revocations import RevocationList
+
+
+def test_revocations_reach_other_workers_and_age_out(tmp_path):
+    path = str(tmp_path / 'revocations.sqlite')
+    revocations = RevocationList(path)
+    other = RevocationList(path)
+    current = {'jti': 'current', 'exp': time.time() + 60}
+    expired = {'jti': 'expired', 'exp': time.time() - 1}
+    revocations.revoke(current)
+    revocations.revoke(expired)
+    assert revocations.is_revoked(current)
+    assert not other.is_revoked(current)
+    other.refresh()
+    assert other.is_revoked(current)
+
+    revocations.purge()
+    assert revocations.status()['size'] == 1
+    assert RevocationList(path).status()['size'] == 1
+    assert not revocations.is_revoked({'jti': 'other', 'exp': 0})
+
+
+def test_links_without_jti_cannot_be_revoked(tmp_path):
+    revocations = RevocationList(str(tmp_path / 'revocations.sqlite'))
+    assert not revocations.is_revoked({'user': 'alice'})
+    with pytest.raises(ValueError):
+        revocations.revoke({'user': 'alice', 'exp': time.time() + 60})
+
+
+def test_revocations_are_kept_in_memory_without_a_store(monkeypatch,
+                                                        tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(RevocationList, 'path', None)
+    revocations = RevocationList()
+    current = {'jti': 'current', 'exp': time.time() + 60}
+    revocations.revoke(current)
+    revocations.refresh()
+    revocations.purge()
+    assert revocations.is_revoked(current)
+    assert not RevocationList().is_revoked(current)
+    assert revocations.status()['persistent'] is False
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,402 @@
+import asyncio
+import json
+import time
+
+from jupyterhub.services.auth import HubAuthenticated
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application, HTTPError, RequestHandler
+
+from ..pool import WarmPool
+from ..revocations import RevocationList
+from ..launcher import HubUnavailable, Launcher
+from ..run import (CreateSharedLinks, DeadlineHandler, gather_or_cancel,
+                   make_app)
+from ..shortlinks import ShortLinkStore
+from ..snapshots import SnapshotStore
+from ..tokens import TokenSigner
+from ..transfer import ContentTransfer
+
+
+PREFIX = '/services/share-link/'
+SECRET = b'a shared secret of 32 bytes long'
+
+
+def service_app(monkeypatch, tmp_path, **settings):
+    "Return the service's Application, keeping its files under tmp_path."
+    monkeypatch.setenv('JUPYTERHUB_SERVICE_PREFIX', PREFIX)
+    settings.setdefault('signer', TokenSigner(SECRET, SECRET))
+    settings.setdefault('warm_pool', WarmPool('api-token'))
+    settings.setdefault('snapshots', SnapshotStore(''))
+    settings.setdefault('short_links',
+                        ShortLinkStore(str(tmp_path / 'links.sqlite')))
+    settings.setdefault('revocations',
+                        RevocationList(str(tmp_path / 'revoked')))
+    return make_app(**settings)
+
+
+def log_in(monkeypatch, users):
+    "Authenticate requests as the user named in their X-User header."
+    def get_current_user(self):
+        return users[self.request.headers['X-User']]
+
+    monkeypatch.setattr(HubAuthenticated, 'get_current_user',
+                        get_current_user)
+
+
+def serve(app, func):
+    """
+    Serve app and return the result of func(fetch), where fetch(path,
+    **kwargs) requests path under the service prefix.
+    """
+    async def run():
+        sock, port = bind_unused_port()
+        server = HTTPServer(app)
+        server.add_sockets([sock])
+        client = AsyncHTTPClient(force_instance=True)
+
+        async def fetch(path, **kwargs):
+            return await client.fetch(
+                f'http://127.0.0.1:{port}{PREFIX}{path}',
+                raise_error=False, follow_redirects=False, **kwargs)
+
+        try:
+            return await func(fetch)
+        finally:
+            client.close()
+            server.stop()
+
+    return asyncio.run(run())
+
+
+def test_app_can_be_made_without_starting_the_service(monkeypatch,
+                                                      tmp_path):
+    "Importing run starts nothing; make_app builds the Application."
+    monkeypatch.setenv('JUPYTERHUB_SERVICE_PREFIX', '/services/share-link/')
+    app = make_app(signer=TokenSigner(b'secret', b'secret'),
+                   warm_pool=WarmPool('api-token'),
+                   snapshots=SnapshotStore(''),
+                   revocations=RevocationList(str(tmp_path / 'revoked')))
+
+    async def run():
+        sock, port = bind_unused_port()
+        server = HTTPServer(app)
+        server.add_sockets([sock])
+        client = AsyncHTTPClient(force_instance=True)
+        try:
+            resp = await client.fetch(
+                f'http://127.0.0.1:{port}/services/share-link/')
+            return json.loads(resp.body)
+        finally:
+            client.close()
+            server.stop()
+
+    info = asyncio.run(run())
+    assert info['worker'] is None
+    assert info['token_cache']['size'] == 0
+    assert info['hub_circuit']['state'] == 'closed'
+
+
+def test_unavailable_hub_sets_retry_after():
+    class Handler(DeadlineHandler, RequestHandler):
+        def get(self):
+            raise HubUnavailable(7)
+
+    async def run():
+        sock, port = bind_unused_port()
+        server = HTTPServer(Application([(r'/', Handler)]))
+        server.add_sockets([sock])
+        client = AsyncHTTPClient(force_instance=True)
+        try:
+            return await client.fetch(f'http://127.0.0.1:{port}/',
+                                      raise_error=False)
+        finally:
+            client.close()
+            server.stop()
+
+    resp = asyncio.run(run())
+    assert resp.code == 503
+    assert resp.headers['Retry-After'] == '7'
+
+
+def test_bad_short_links_are_refused(monkeypatch, tmp_path):
+    app = service_app(monkeypatch, tmp_path)
+    expired = app.settings['short_links'].issue(
+        {'user': 'alice', 'path': 'a.ipynb', 'opts': {},
+         'exp': time.time() - 1})
+
+    async def inspect(fetch):
+        return [(await fetch(path)).code
+                for path in ('inspect?id=abcdefgh', f'inspect?id={expired}',
+                             'inspect')]
+
+    assert serve(app, inspect) == [403, 403, 400]
+
+
+def test_links_are_revoked_by_their_creator_or_an_admin(monkeypatch,
+                                                        tmp_path):
+    log_in(monkeypatch, {'alice': {'name': 'alice'},
+                         'bob': {'name': 'bob'},
+                         'carol': {'name': 'carol', 'admin': True}})
+    app = service_app(monkeypatch, tmp_path)
+    short_links = app.settings['short_links']
+
+    def issue(jti):
+        claims = {'user': 'alice', 'path': 'a.ipynb', 'opts': {},
+                  'exp': time.time() + 60}
+        if jti is not None:
+            claims['jti'] = jti
+        return f'https://hub.example.org{PREFIX}open?id={short_links.issue(claims)}'
+
+    links = {jti: issue(jti) for jti in ('one', 'two', None)}
+
+    async def revoke(fetch):
+        async def post(user, link):
+            resp = await fetch('revoke', method='POST',
+                               headers={'X-User': user},
+                               body=json.dumps({'link': link}))
+            return resp.code
+
+        codes = [await post('bob', links['one']),
+                 await post('alice', links['one']),
+                 await post('carol', links['two']),
+                 await post('alice', links[None])]
+        resp = await fetch('revoke', method='POST',
+                           headers={'X-User': 'alice'}, body='{}')
+        codes.append(resp.code)
+        for link in links.values():
+            resp = await fetch(f'inspect?{link.split("?")[1]}')
+            codes.append(resp.code)
+        return codes
+
+    assert serve(app, revoke) == [403, 200, 200, 400, 400, 403, 403, 200]
+
+
+def test_bad_tokens_are_refused(monkeypatch, tmp_path):
+    app = service_app(monkeypatch, tmp_path)
+    expired = asyncio.run(app.settings['signer'].encode_link(
+        {'user': 'alice', 'path': 'a.ipynb', 'opts': {},
+         'exp': time.time() - 1}))
+
+    async def inspect(fetch):
+        return [(await fetch(f'inspect?token={token}')).code
+                for token in ('eyJgarbage', 'ZXlKgarbage', expired)]
+
+    assert serve(app, inspect) == [403, 403, 403]
+
+
+def test_batch_issues_what_it_can(monkeypatch, tmp_path):
+    "One bad path fails on its own; bad requests are refused outright."
+    log_in(monkeypatch, {'alice': {'name': 'alice'}})
+
+    async def find_source_server(self, base_url):
+        return {'url': base_url, 'user_options': {'image': 'a'}}
+
+    monkeypatch.setattr(CreateSharedLinks, '_find_source_server',
+                        find_source_server)
+    monkeypatch.setattr(CreateSharedLinks, 'max_paths', 3)
+    app = service_app(monkeypatch, tmp_path)
+
+    async def create(fetch):
+        async def post(data):
+            resp = await fetch('create/batch', method='POST',
+                               headers={'X-User': 'alice'},
+                               body=json.dumps(data))
+            return resp.code, json.loads(resp.body) if resp.code == 200 else None
+
+        base_url = '/user/alice/'
+        return [await post({'base_url': base_url,
+                            'paths': ['a.ipynb', 7, 'b.ipynb']}),
+                await post({'base_url': base_url, 'paths': 'a.ipynb'}),
+                await post({'base_url': base_url}),
+                await post({'base_url': base_url, 'paths': ['a'] * 4})]
+
+    results = serve(app, create)
+    assert [code for code, _ in results] == [200, 400, 400, 400]
+    links = results[0][1]['links']
+    assert [link['path'] for link in links] == ['a.ipynb', 7, 'b.ipynb']
+    assert 'link' in links[0] and 'link' in links[2]
+    assert 'must be a string' in links[1]['error']
+    claims = app.settings['short_links'].get(links[2]['link'].split('=')[1])
+    assert claims['path'] == 'b.ipynb'
+
+
+def test_gather_or_cancel_cancels_the_rest_on_failure():
+    cancelled = []
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("spawn failed")
+
+    async def wait():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        started = time.monotonic()
+        futures = [asyncio.ensure_future(wait()),
+                   asyncio.ensure_future(fail())]
+        try:
+            await gather_or_cancel(*futures)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("gather_or_cancel did not raise")
+        await asyncio.sleep(0)
+        assert futures[0].cancelled()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) < 1
+    assert cancelled == [True]
+
+
+def open_link(monkeypatch, tmp_path, sender, recipient, find_or_launch):
+    """
+    Open a link from sender as recipient, with Launcher.find_or_launch
+    replaced. Return the response and the copies made.
+    """
+    log_in(monkeypatch, {recipient: {'name': recipient}})
+    monkeypatch.setattr(Launcher, 'find_or_launch', find_or_launch)
+    copies = []
+
+    async def copy(self, source_url, source_path, target_url, dest_path,
+                   progress=None):
+        copies.append((source_url, target_url))
+
+    monkeypatch.setattr(ContentTransfer, 'copy', copy)
+    app = service_app(monkeypatch, tmp_path)
+    link_id = app.settings['short_links'].issue(
+        {'user': sender, 'path': 'a.ipynb', 'opts': {'image': 'a'},
+         'exp': time.time() + 60})
+
+    async def get(fetch):
+        return await fetch(f'open?id={link_id}',
+                           headers={'X-User': recipient})
+
+    return serve(app, get), copies
+
+
+def test_opening_ones_own_link_uses_one_server(monkeypatch, tmp_path):
+    calls = []
+
+    async def find_or_launch(self, user_options, headers):
+        calls.append((self.user['name'], self.role))
+        return {'name': 's', 'url': '/user/alice/s/'}
+
+    resp, copies = open_link(monkeypatch, tmp_path, 'alice', 'alice',
+                             find_or_launch)
+    assert resp.code == 302
+    assert resp.headers['Location'] == '/user/alice/s/lab/tree/a.ipynb'
+    assert calls == [('alice', 'target')]
+    [(source_url, target_url)] = copies
+    assert source_url == target_url
+
+
+def test_failed_source_cancels_target(monkeypatch, tmp_path):
+    "If one server cannot be started, the wait for the other stops."
+    cancelled = []
+
+    async def find_or_launch(self, user_options, headers):
+        if self.role == 'source':
+            await asyncio.sleep(0.01)
+            raise HTTPError(500, "Failed to launch")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(self.user['name'])
+            raise
+
+    resp, copies = open_link(monkeypatch, tmp_path, 'alice', 'bob',
+                             find_or_launch)
+    assert resp.code == 500
+    assert resp.request_time < 1
+    assert cancelled == ['bob']
+    assert copies == []
+
+
+def test_snapshot_is_closed_if_the_target_fails(monkeypatch, tmp_path):
+    log_in(monkeypatch, {'bob': {'name': 'bob'}})
+    snapshot = tmp_path / 'snapshot'
+    snapshot.write_bytes(b'{}')
+    opened = []
+
+    def open_snapshot(self, digest):
+        opened.append(snapshot.open('rb'))
+        return opened[-1], 2
+
+    async def find_or_launch(self, user_options, headers):
+        raise HTTPError(500, "Failed to launch")
+
+    monkeypatch.setattr(SnapshotStore, 'open', open_snapshot)
+    monkeypatch.setattr(Launcher, 'find_or_launch', find_or_launch)
+    app = service_app(monkeypatch, tmp_path,
+                      snapshots=SnapshotStore(str(tmp_path / 'snapshots')))
+    link_id = app.settings['short_links'].issue(
+        {'user': 'alice', 'path': 'a.ipynb', 'opts': {'image': 'a'},
+         'exp': time.time() + 60, 'snap': 'digest'})
+
+    async def get(fetch):
+        return await fetch(f'open?id={link_id}', headers={'X-User': 'bob'})
+
+    assert serve(app, get).code == 500
+    [file] = opened
+    assert file.closed
+
+
+def test_snapshot_links_work_with_snapshots_disabled(monkeypatch, tmp_path):
+    "Links issued with a snapshot copy from the sender once it is disabled."
+    log_in(monkeypatch, {'bob': {'name': 'bob'}})
+    roles = []
+
+    async def find_or_launch(self, user_options, headers):
+        roles.append(self.role)
+        return {'name': 's', 'url': f'/user/{self.user["name"]}/s/'}
+
+    async def copy(self, source_url, source_path, target_url, dest_path,
+                   progress=None):
+        pass
+
+    monkeypatch.setattr(Launcher, 'find_or_launch', find_or_launch)
+    monkeypatch.setattr(ContentTransfer, 'copy', copy)
+    monkeypatch.setattr(SnapshotStore, 'directory', None)
+    app = service_app(monkeypatch, tmp_path, snapshots=SnapshotStore())
+    link_id = app.settings['short_links'].issue(
+        {'user': 'alice', 'path': 'a.ipynb', 'opts': {'image': 'a'},
+         'exp': time.time() + 60, 'snap': 'digest'})
+
+    async def get(fetch):
+        return await fetch(f'open?id={link_id}', headers={'X-User': 'bob'})
+
+    assert serve(app, get).code == 302
+    assert sorted(roles) == ['source', 'target']
+
+
+def test_source_server_newer_than_cached_user_model(monkeypatch, tmp_path):
+    "A server missing from the cached user model is looked for afresh."
+    log_in(monkeypatch, {'alice': {'name': 'alice'}})
+    lookups = []
+
+    async def get_user_data(self, fresh=False):
+        lookups.append(fresh)
+        servers = {}
+        if fresh:
+            servers['new'] = {'url': '/user/alice/new/',
+                              'user_options': {'image': 'a'}}
+        return {'servers': servers}
+
+    monkeypatch.setattr(Launcher, 'get_user_data', get_user_data)
+    app = service_app(monkeypatch, tmp_path)
+
+    async def create(fetch):
+        return await fetch('create', method='POST',
+                           headers={'X-User': 'alice'},
+                           body=json.dumps({'base_url': '/user/alice/new/',
+                                            'path': 'a.ipynb'}))
+
+    resp = serve(app, create)
+    assert resp.code == 200
+    assert lookups == [False, True]
@@ -0,0 +1,34 @@
+import asyncio
+from datetime import datetime, timedelta
+import time
+
+from ..shortlinks import ShortLinkStore
+
+
+def test_short_links_are_shared_through_the_database(tmp_path):
+    path = str(tmp_path / 'links.sqlite')
+    store = ShortLinkStore(path)
+    link_id = store.issue({'user': 'alice', 'path': 'a.ipynb',
+                           'exp': datetime.utcnow() + timedelta(hours=1)})
+    assert len(link_id) == 8
+    assert store.get(link_id)['path'] == 'a.ipynb'
+    assert store.stats['hits'] == 1
+
+    # Another worker process has its own cache.
+    other = ShortLinkStore(path)
+    assert other.get(link_id)['user'] == 'alice'
+    assert other.get(link_id)['exp'] > time.time()
+    assert other.stats == {**other.stats, 'hits': 1, 'misses': 1}
+    assert other.get('notanid') is None
+
+
+def test_expired_short_links_are_purged_in_batches(tmp_path):
+    store = ShortLinkStore(str(tmp_path / 'links.sqlite'))
+    store.purge_batch = 2
+    expired = [store.issue({'user': 'alice', 'exp': time.time() - 1})
+               for _ in range(5)]
+    current = store.issue({'user': 'alice', 'exp': time.time() + 60})
+    asyncio.run(store.purge())
+    assert store.stats['purged'] == 5
+    assert all(store.get(link_id) is None for link_id in expired)
+    assert store.get(current) is not None
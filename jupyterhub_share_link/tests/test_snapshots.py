@@ -0,0 +1,53 @@
+import os
+import time
+
+from ..snapshots import SnapshotStore
+
+
+def snapshot(store, data, exp):
+    writer = store.writer()
+    writer.write(data)
+    return writer.commit(exp)
+
+
+def test_snapshot_store_dedupes_and_reloads(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    later = time.time() + 60
+    digest = snapshot(store, b'hello', later)
+    assert snapshot(store, b'hello', later + 60) == digest
+    assert store.status() == {'enabled': True, 'snapshots': 1, 'bytes': 5}
+    store = SnapshotStore(str(tmp_path))
+    file, size = store.open(digest)
+    with file:
+        assert (file.read(), size) == (b'hello', 5)
+
+
+def test_snapshot_store_purges_expired_then_least_recently_used(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    store.max_bytes = 10
+    later = time.time() + 60
+    expired = snapshot(store, b'x', time.time() - 1)
+    assert store.open(expired) is None
+    first = snapshot(store, b'a' * 4, later)
+    second = snapshot(store, b'b' * 4, later)
+    os.utime(tmp_path / second, (0, 0))  # second is least recently used
+    third = snapshot(store, b'c' * 4, later)
+    assert store.open(second) is None
+    for digest in (first, third):
+        file, _ = store.open(digest)
+        file.close()
+
+
+def test_snapshot_store_shared_between_workers(tmp_path):
+    "Stores on one directory see each other's snapshots and removals."
+    first = SnapshotStore(str(tmp_path))
+    second = SnapshotStore(str(tmp_path))
+    later = time.time() + 60
+    digest = snapshot(first, b'hello', later)
+    file, _ = second.open(digest)
+    file.close()
+    first.max_bytes = 0
+    first.purge()
+    second.refresh()
+    assert second.open(digest) is None
+    assert second.status()['snapshots'] == 0
@@ -0,0 +1,97 @@
+import asyncio
+import base64
+from datetime import datetime, timedelta
+import time
+
+import jwt
+import pytest
+
+from ..generate_keys import ALGORITHMS, generate_keys
+from ..tokens import (TokenSigner, VerifiedTokenCache, load_private_key,
+                      load_public_key)
+
+
+SECRET = b'a shared secret of 32 bytes long'
+
+
+def test_verified_token_cache_hits_until_expiry():
+    cache = VerifiedTokenCache()
+    assert cache.get('abc') is None
+    cache.put('abc', {'user': 'alice', 'exp': time.time() + 60})
+    assert cache.get('abc')['user'] == 'alice'
+    cache.put('old', {'user': 'bob', 'exp': time.time() - 1})
+    assert cache.get('old') is None
+    assert cache.status()['size'] == 1
+    assert cache.stats == {'hits': 1, 'misses': 2}
+
+
+def test_verified_token_cache_is_bounded():
+    cache = VerifiedTokenCache()
+    cache.max_size = 2
+    for token in ('a', 'b', 'c'):
+        cache.put(token, {'exp': time.time() + 60})
+    assert cache.get('a') is None
+    assert cache.get('c') is not None
+
+
+def test_token_signer_infers_algorithm():
+    "Tokens round-trip with the algorithm that goes with each kind of key."
+    for algorithm in ALGORITHMS:
+        private_pem, public_pem = generate_keys(algorithm)
+        signer = TokenSigner(load_private_key(private_pem),
+                             load_public_key(public_pem))
+        assert signer.algorithm == algorithm
+
+        async def round_trip(signer):
+            token = await signer.encode({'user': 'alice',
+                                         'exp': time.time() + 60})
+            return await signer.decode(token)
+
+        assert asyncio.run(round_trip(signer))['user'] == 'alice'
+    signer = TokenSigner(load_private_key(SECRET + b'\n', 'HS256'),
+                         load_public_key(SECRET + b'\n', 'HS256'))
+    assert signer.algorithm == 'HS256'
+
+
+def test_keys_that_are_not_pem_are_refused():
+    "A shared secret must be asked for, and long enough."
+    private_pem, public_pem = generate_keys('EdDSA')
+    for load, pem in ((load_private_key, private_pem),
+                      (load_public_key, public_pem)):
+        for data in (SECRET, pem[:len(pem) // 2]):
+            with pytest.raises(ValueError, match='ALGORITHM=HS256'):
+                load(data)
+        with pytest.raises(ValueError, match='at least 32 bytes'):
+            load(b'sekrit\n', 'HS256')
+
+
+def test_link_tokens_are_compact_and_legacy_links_still_open():
+    signer = TokenSigner(SECRET, SECRET)
+    opts = {f'field{i}': 'jupyter/datascience-notebook' for i in range(20)}
+    payload = {'user': 'alice', 'path': 'a.ipynb', 'opts': opts,
+               'exp': datetime.utcnow() + timedelta(hours=1)}
+
+    async def run():
+        compact = await signer.encode_link(payload)
+        legacy = base64.urlsafe_b64encode(
+            await signer.encode(payload)).decode()
+        return (compact, legacy, await signer.decode_link(compact),
+                await signer.decode_link(legacy))
+
+    compact, legacy, from_compact, from_legacy = asyncio.run(run())
+    assert jwt.get_unverified_header(compact)['zip'] == 'DEF'
+    assert len(compact) < len(legacy) / 2
+    assert from_compact == from_legacy
+    assert from_compact['opts'] == opts
+
+
+def test_expired_compact_link_token_is_rejected():
+    signer = TokenSigner(SECRET, SECRET)
+
+    async def run():
+        token = await signer.encode_link({'user': 'alice',
+                                          'exp': time.time() - 1})
+        await signer.decode_link(token)
+
+    with pytest.raises(jwt.exceptions.ExpiredSignatureError):
+        asyncio.run(run())
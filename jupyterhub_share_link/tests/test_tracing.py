@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application, RequestHandler
+
+from ..tracing import (JSONLinesExporter, Trace, TracedHandler,
+                       _current_trace, span, traced)
+
+
+async def step():
+    with span('inner'):
+        with span('innermost'):
+            await asyncio.sleep(0.01)
+
+
+class Traced(TracedHandler, RequestHandler):
+    async def get(self):
+        with span('first'):
+            await step()
+        await asyncio.gather(traced('a', step()), traced('b', step()))
+        self.write('ok')
+
+
+def test_spans_are_exported_and_sent_as_server_timing(tmp_path):
+    "Spans nest across tasks, and two levels of them reach Server-Timing."
+    path = tmp_path / 'traces.jsonl'
+
+    async def run():
+        sock, port = bind_unused_port()
+        app = Application([(r'/', Traced)],
+                          trace_exporter=JSONLinesExporter(str(path)))
+        server = HTTPServer(app)
+        server.add_sockets([sock])
+        client = AsyncHTTPClient(force_instance=True)
+        try:
+            return await client.fetch(f'http://127.0.0.1:{port}/')
+        finally:
+            client.close()
+            server.stop()
+
+    resp = asyncio.run(run())
+    timing = resp.headers['Server-Timing']
+    assert sorted(entry.split(';')[0] for entry in timing.split(', ')) == [
+        'a', 'a.inner', 'b', 'b.inner', 'first', 'first.inner', 'total']
+
+    trace, = [json.loads(line) for line in path.read_text().splitlines()]
+    assert trace['name'] == 'Traced'
+    assert trace['status'] == 200
+    spans = {s['id']: s for s in trace['spans']}
+    parents = sorted(spans[s['parent']]['name'] for s in spans.values()
+                     if s['name'] == 'inner')
+    assert parents == ['a', 'b', 'first']
+
+
+def test_span_outside_a_request_does_nothing():
+    async def run():
+        with span('untraced'):
+            await asyncio.sleep(0)
+
+    asyncio.run(run())
+
+
+def test_summary_names_child_spans_after_their_parents():
+    trace = Trace('Traced')
+    token = _current_trace.set(trace)
+    try:
+        with span('resolve'):
+            with span('source'):
+                with span('hub_user'):
+                    pass
+            with span('target'):
+                pass
+    finally:
+        _current_trace.reset(token)
+    assert [name for name, _ in trace.timings()] == [
+        'resolve', 'resolve.source', 'resolve.target']
+    assert trace.summary().startswith('resolve ')
+    assert 'resolve.source ' in trace.summary()
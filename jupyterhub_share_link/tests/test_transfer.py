@@ -0,0 +1,160 @@
+import asyncio
+import base64
+import json
+
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import (Application, HTTPError, RequestHandler,
+                         stream_request_body)
+
+from ..transfer import ContentPipe, ContentTransfer
+
+
+def test_content_pipe_spills_beyond_buffer():
+    "Chunks beyond max_buffer_size go to disk and come back out in order."
+    async def run():
+        pipe = ContentPipe(max_buffer_size=10, read_size=4)
+        for chunk in (b'0123456', b'789', b'abcdef', b'g'):
+            pipe.write(chunk)
+        pipe.close()
+        assert pipe._buffered <= 10
+        out = []
+        while True:
+            chunk = await pipe.read()
+            if not chunk:
+                break
+            out.append(chunk)
+        assert b''.join(out) == b'0123456789abcdefg'
+
+    asyncio.run(run())
+
+
+class Source(RequestHandler):
+    "The contents API and /files endpoint of a source server."
+    def initialize(self, model):
+        self.model = model
+
+    def get(self, kind, path):
+        if kind == 'files':
+            self.write(base64.b64decode(self.model['content']))
+        elif self.get_argument('content', '1') == '0':
+            self.write(dict(self.model, content=None))
+        else:
+            self.write(self.model)
+
+
+@stream_request_body
+class Dest(RequestHandler):
+    "A destination server that records each PUT to the contents API."
+    def initialize(self, received):
+        self.received = received
+
+    def prepare(self):
+        self.chunks = []
+
+    def data_received(self, chunk):
+        self.chunks.append(chunk)
+
+    def put(self, path):
+        self.received.append((path, json.loads(b''.join(self.chunks))))
+        self.set_status(201)
+
+
+def copy(model, **attrs):
+    "Copy model between two local servers and return the PUTs received."
+    received = []
+
+    async def run():
+        sock, port = bind_unused_port()
+        server = HTTPServer(Application([
+            (r'/src/(api/contents|files)/(.*)', Source, {'model': model}),
+            (r'/dst/api/contents/(.*)', Dest, {'received': received}),
+        ]))
+        server.add_sockets([sock])
+        try:
+            base = f'http://127.0.0.1:{port}'
+            transfer = ContentTransfer(headers={})
+            for name, value in attrs.items():
+                setattr(transfer, name, value)
+            resp = await transfer.copy(f'{base}/src', 'a.bin',
+                                       f'{base}/dst', 'b.bin')
+            assert resp.code == 201
+        finally:
+            server.stop()
+
+    asyncio.run(run())
+    return received
+
+
+def test_content_transfer_streams_model():
+    "A small file's model is copied from a GET into a single PUT."
+    model = {'name': 'a.bin', 'path': 'a.bin', 'type': 'file',
+             'format': 'base64', 'size': 200000,
+             'content': base64.b64encode(b'x' * 200000).decode()}
+    received = copy(model, max_buffer_size=1024)
+    assert received == [('b.bin', model)]
+
+
+def test_content_transfer_chunks_large_files():
+    "A file above chunk_threshold is uploaded as chunks 1, 2, ..., -1."
+    data = bytes(range(256)) * 100
+    model = {'name': 'a.bin', 'path': 'a.bin', 'type': 'file',
+             'format': 'base64', 'size': len(data),
+             'content': base64.b64encode(data).decode()}
+    received = copy(model, chunk_threshold=1000, chunk_size=10000)
+    assert [body['chunk'] for _, body in received] == [1, 2, -1]
+    assert b''.join(base64.b64decode(body['content'])
+                    for _, body in received) == data
+
+
+def test_content_transfer_copies_directories():
+    "A directory is recreated at the destination with all of its files."
+    tree = {
+        'proj': {'type': 'directory', 'content': [
+            {'name': 'a.txt', 'type': 'file', 'size': 1},
+            {'name': 'sub', 'type': 'directory', 'size': None}]},
+        'proj/a.txt': {'type': 'file', 'format': 'text', 'content': 'a',
+                       'size': 1},
+        'proj/sub': {'type': 'directory', 'content': [
+            {'name': 'b.txt', 'type': 'file', 'size': 2}]},
+        'proj/sub/b.txt': {'type': 'file', 'format': 'text', 'content': 'bb',
+                           'size': 2},
+    }
+
+    class Tree(RequestHandler):
+        def get(self, path):
+            model = dict(tree[path])
+            if self.get_argument('content', '1') == '0':
+                model['content'] = None
+            self.write(model)
+
+    received = []
+    progress = []
+
+    async def run():
+        sock, port = bind_unused_port()
+        server = HTTPServer(Application([
+            (r'/src/api/contents/(.*)', Tree),
+            (r'/dst/api/contents/(.*)', Dest, {'received': received}),
+        ]))
+        server.add_sockets([sock])
+        try:
+            base = f'http://127.0.0.1:{port}'
+            transfer = ContentTransfer(headers={})
+            await transfer.copy(f'{base}/src', 'proj', f'{base}/dst', 'copy',
+                                progress=lambda *args: progress.append(args))
+            transfer.tree_max_bytes = 2
+            try:
+                await transfer.copy(f'{base}/src', 'proj', f'{base}/dst', 'x')
+            except HTTPError as e:
+                assert e.status_code == 413
+            else:
+                raise AssertionError("expected the size budget to be enforced")
+        finally:
+            server.stop()
+
+    asyncio.run(run())
+    assert [path for path, _ in received[:2]] == ['copy', 'copy/sub']
+    assert sorted((path, body['content']) for path, body in received[2:]) \
+        == [('copy/a.txt', 'a'), ('copy/sub/b.txt', 'bb')]
+    assert progress[-1] == (2, 2, 3, 3)
@@ -0,0 +1,262 @@
+"""
+Signing, verification and bookkeeping for share tokens.
+
+Links used to carry a JWT, base64-encoded once more (the legacy format).
+They now carry a compact JWS whose payload is the claims as JSON,
+deflate-compressed when that makes it shorter. Both formats are accepted.
+"""
+import asyncio
+import base64
+import calendar
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import functools
+import hashlib
+import json
+import os
+import time
+import zlib
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+import jwt
+
+
+# Shorter HS256 secrets are weaker than the hash; see RFC 7518, section 3.2.
+MIN_SECRET_LENGTH = 32
+
+
+def _load_secret(data):
+    secret = data.strip()
+    if len(secret) < MIN_SECRET_LENGTH:
+        raise ValueError(f"A shared secret for HS256 must be at least "
+                         f"{MIN_SECRET_LENGTH} bytes long.")
+    return secret
+
+
+def load_private_key(pem, algorithm=None):
+    """
+    Parse a PEM-encoded private key into a key object, once.
+
+    If algorithm is 'HS256', the data is instead a shared secret of at
+    least MIN_SECRET_LENGTH bytes, returned as bytes.
+    """
+    if algorithm == 'HS256':
+        return _load_secret(pem)
+    try:
+        return serialization.load_pem_private_key(
+            pem, password=None, backend=default_backend())
+    except ValueError as e:
+        raise ValueError(
+            f"Not a PEM-encoded private key ({e}). To sign with a shared "
+            f"secret, set JUPYTERHUB_SHARE_LINK_ALGORITHM=HS256.") from e
+
+
+def load_public_key(pem, algorithm=None):
+    """
+    Parse a PEM-encoded public key into a key object, once.
+
+    If algorithm is 'HS256', the data is instead a shared secret of at
+    least MIN_SECRET_LENGTH bytes, returned as bytes.
+    """
+    if algorithm == 'HS256':
+        return _load_secret(pem)
+    try:
+        return serialization.load_pem_public_key(
+            pem, backend=default_backend())
+    except ValueError as e:
+        raise ValueError(
+            f"Not a PEM-encoded public key ({e}). To verify with a shared "
+            f"secret, set JUPYTERHUB_SHARE_LINK_ALGORITHM=HS256.") from e
+
+
+_EC_ALGORITHMS = {
+    'secp256r1': 'ES256',
+    'secp384r1': 'ES384',
+    'secp521r1': 'ES512',
+}
+
+
+def algorithm_for_key(key):
+    "Return the JWT signing algorithm that goes with a key."
+    if isinstance(key, bytes):
+        return 'HS256'
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return 'RS256'
+    if isinstance(key, (ed25519.Ed25519PrivateKey,
+                        ed25519.Ed25519PublicKey)):
+        return 'EdDSA'
+    if isinstance(key, (ec.EllipticCurvePrivateKey,
+                        ec.EllipticCurvePublicKey)):
+        try:
+            return _EC_ALGORITHMS[key.curve.name]
+        except KeyError:
+            pass
+    raise ValueError(f"Unsupported key type for signing share links: {key!r}")
+
+
+def _encode_compact(payload, key, algorithm):
+    claims = dict(payload)
+    if isinstance(claims.get('exp'), datetime):
+        claims['exp'] = calendar.timegm(claims['exp'].utctimetuple())
+    data = json.dumps(claims, separators=(',', ':')).encode('utf-8')
+    headers = {'typ': None}
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) < len(data):
+        data = compressed
+        headers['zip'] = 'DEF'
+    token = jwt.api_jws.PyJWS().encode(data, key, algorithm=algorithm,
+                                       headers=headers)
+    if isinstance(token, bytes):
+        token = token.decode('ascii')
+    return token
+
+
+def _decode_compact(token, key, algorithm):
+    jws = jwt.api_jws.PyJWS()
+    if hasattr(jws, 'decode_complete'):
+        decoded = jws.decode_complete(token, key, algorithms=[algorithm])
+        header, data = decoded['header'], decoded['payload']
+    else:
+        # PyJWT < 2
+        header = jwt.get_unverified_header(token)
+        data = jws.decode(token, key, algorithms=[algorithm])
+    # The signature is verified, so the payload is one we compressed.
+    if header.get('zip') == 'DEF':
+        data = zlib.decompress(data, -zlib.MAX_WBITS)
+    claims = json.loads(data.decode('utf-8'))
+    if 'exp' in claims and claims['exp'] <= time.time():
+        raise jwt.exceptions.ExpiredSignatureError("Signature has expired")
+    return claims
+
+
+def is_compact(link_token):
+    "Return True if a token from a link is in the compact format."
+    # A JWS starts with its base64url-encoded JSON header, '{"' -> 'eyJ'.
+    # The legacy format encodes that again, so starts with 'ZXlK'.
+    return link_token.startswith('eyJ')
+
+
+class TokenSigner():
+    """
+    Sign and verify share tokens on a pool of threads.
+
+    The algorithm is inferred from the keys unless given: RS256 for RSA,
+    ES256 for P-256, EdDSA for Ed25519, and HS256 for a shared secret.
+
+    Signing with an RSA key takes around a millisecond of CPU. Doing it on
+    the IOLoop would stall every other request during a burst of /create,
+    so the work is handed to an executor.
+
+    link_format is the format of the tokens that encode_link() puts in
+    links: 'compact' or 'legacy'.
+    """
+
+    max_workers = int(os.getenv('JUPYTERHUB_SHARE_LINK_CRYPTO_THREADS', 4))
+    link_format = os.getenv('JUPYTERHUB_SHARE_LINK_TOKEN_FORMAT', 'compact')
+
+    def __init__(self, private_key, public_key, algorithm=None):
+        if algorithm is None:
+            algorithm = algorithm_for_key(private_key)
+            if algorithm_for_key(public_key) != algorithm:
+                raise ValueError(
+                    "The private and public keys are of different types.")
+        self.private_key = private_key
+        self.public_key = public_key
+        self.algorithm = algorithm
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='share-link-crypto')
+
+    def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def encode(self, payload):
+        "Return a signed token, as bytes, for the claims in payload."
+        token = await self._run(jwt.encode, payload, self.private_key,
+                                algorithm=self.algorithm)
+        # PyJWT < 2 returns bytes and PyJWT >= 2 returns str.
+        if isinstance(token, str):
+            token = token.encode('ascii')
+        return token
+
+    async def decode(self, token):
+        "Return the claims of token, raising if it is invalid or expired."
+        return await self._run(jwt.decode, token, self.public_key,
+                               algorithms=[self.algorithm])
+
+    async def encode_link(self, payload):
+        "Return a signed token to put in a link, as str, for payload."
+        if self.link_format == 'legacy':
+            token = await self.encode(payload)
+            return base64.urlsafe_b64encode(token).decode('ascii')
+        return await self._run(_encode_compact, payload, self.private_key,
+                               self.algorithm)
+
+    async def decode_link(self, link_token):
+        """
+        Return the claims of a token from a link, in either format, raising
+        if it is invalid or expired.
+        """
+        if is_compact(link_token):
+            return await self._run(_decode_compact, link_token,
+                                   self.public_key, self.algorithm)
+        return await self.decode(base64.urlsafe_b64decode(link_token))
+
+
+class VerifiedTokenCache():
+    """
+    LRU cache of the claims of tokens whose signatures have been verified.
+
+    The same link is typically opened by many users, and reloaded, in a
+    short time. Verifying its signature again each time is wasted work, so
+    the claims are kept, keyed by a digest of the token, until the token
+    expires.
+    """
+
+    max_size = int(os.getenv('JUPYTERHUB_SHARE_LINK_TOKEN_CACHE_SIZE', 4096))
+
+    def __init__(self):
+        self._entries = OrderedDict()  # digest -> claims
+        self.stats = Counter(hits=0, misses=0)
+
+    @staticmethod
+    def _digest(token):
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).digest()
+
+    def get(self, token):
+        "Return the claims of token if it was verified and has not expired."
+        digest = self._digest(token)
+        claims = self._entries.get(digest)
+        if claims is not None:
+            if claims['exp'] > time.time():
+                self._entries.move_to_end(digest)
+                self.stats['hits'] += 1
+                return claims
+            del self._entries[digest]
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, token, claims):
+        "Remember the claims of a token whose signature has been verified."
+        if self.max_size <= 0 or 'exp' not in claims:
+            return
+        digest = self._digest(token)
+        self._entries[digest] = claims
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def status(self):
+        "Return a summary of the cache for reporting."
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {'size': len(self._entries),
+                'hit_rate': self.stats['hits'] / lookups if lookups else None,
+                **self.stats}
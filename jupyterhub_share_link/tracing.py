@@ -0,0 +1,172 @@
+"""
+Lightweight tracing of the steps taken to handle one request.
+
+A handler that mixes in TracedHandler starts a Trace for each request. Code
+that it awaits, directly or in tasks it starts, records spans with
+``with span(name):``; outside a traced request, span does nothing. When the
+request finishes, the trace is handed to an exporter, and the top-level spans
+and their children are sent to the browser in a Server-Timing header.
+"""
+import contextlib
+import contextvars
+import importlib
+import json
+import os
+import time
+import uuid
+
+
+_current_trace = contextvars.ContextVar('share_link_trace', default=None)
+_current_span = contextvars.ContextVar('share_link_span', default=None)
+
+
+class Trace():
+    "The spans recorded while handling one request."
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.started = time.time()
+        self._clock = time.monotonic()
+        self.spans = []
+
+    def elapsed(self):
+        return time.monotonic() - self._clock
+
+    def timings(self, depth=2):
+        """
+        Return (name, duration) for the finished spans at most depth levels
+        deep, in the order they started. A nested span is named after its
+        parents too, as in 'resolve.source'.
+        """
+        names = {}
+        result = []
+        for s in self.spans:
+            parent = names.get(s['parent'])
+            if s['parent'] is not None and parent is None:
+                continue  # Its parent is too deep.
+            name = s['name'] if parent is None else f"{parent}.{s['name']}"
+            if name.count('.') >= depth:
+                continue
+            names[s['id']] = name
+            if s['duration'] is not None:
+                result.append((name, s['duration']))
+        return result
+
+    def summary(self):
+        "Return the top-level spans and their children as text, for logging."
+        return ', '.join(f"{name} {duration:.3f}s"
+                         for name, duration in self.timings())
+
+    def server_timing(self):
+        "Return the value of a Server-Timing header for the trace so far."
+        entries = [f"{name};dur={1000 * duration:.1f}"
+                   for name, duration in self.timings()]
+        entries.append(f'total;dur={1000 * self.elapsed():.1f}')
+        return ', '.join(entries)
+
+    def to_dict(self):
+        return {'trace_id': self.id,
+                'name': self.name,
+                'started': self.started,
+                'duration': self.elapsed(),
+                'spans': self.spans}
+
+
+def current_trace():
+    "Return the Trace of the request being handled, or None."
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def span(name):
+    "Record the time spent in the with block as a span of the current trace."
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    record = {'id': len(trace.spans),
+              'parent': _current_span.get(),
+              'name': name,
+              'start': trace.elapsed(),
+              'duration': None}
+    trace.spans.append(record)
+    token = _current_span.set(record['id'])
+    try:
+        yield
+    except BaseException as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['duration'] = trace.elapsed() - record['start']
+        _current_span.reset(token)
+
+
+async def traced(name, awaitable):
+    "Await awaitable within a span, for use in tasks that run concurrently."
+    with span(name):
+        return await awaitable
+
+
+class JSONLinesExporter():
+    """
+    Append each trace to a file, as one line of JSON.
+
+    Nothing is written unless path is set.
+    """
+
+    path = os.getenv('JUPYTERHUB_SHARE_LINK_TRACE_FILE')
+
+    def __init__(self, path=None):
+        if path is not None:
+            self.path = path
+        self._file = None
+
+    def export(self, trace):
+        if not self.path:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'a', buffering=1)
+        self._file.write(json.dumps(trace) + '\n')
+
+
+def load_exporter(name=None):
+    """
+    Return an instance of the exporter class named by a dotted path.
+
+    Exporters have one method, export(trace), which is passed each trace as
+    a JSON-serializable dict.
+    """
+    if name is None:
+        name = os.getenv('JUPYTERHUB_SHARE_LINK_TRACE_EXPORTER',
+                         'jupyterhub_share_link.tracing.JSONLinesExporter')
+    module_name, _, class_name = name.rpartition('.')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class TracedHandler():
+    """
+    Mixin for a RequestHandler that traces each request it handles.
+
+    The exporter is taken from the Application's 'trace_exporter' setting.
+    """
+
+    def prepare(self):
+        self.trace = Trace(type(self).__name__)
+        _current_trace.set(self.trace)
+        return super().prepare()
+
+    def finish(self, chunk=None):
+        trace = getattr(self, 'trace', None)
+        if trace is not None and not self._headers_written:
+            self.set_header('Server-Timing', trace.server_timing())
+        return super().finish(chunk)
+
+    def on_finish(self):
+        trace = getattr(self, 'trace', None)
+        exporter = self.settings.get('trace_exporter')
+        if trace is not None and exporter is not None:
+            record = trace.to_dict()
+            record['status'] = self.get_status()
+            exporter.export(record)
+        super().on_finish()
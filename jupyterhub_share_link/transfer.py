@@ -0,0 +1,443 @@
+"""
+Copy content between Jupyter servers through the contents API.
+
+The copy is streamed: the body of the GET from the source server is fed into
+the body of the PUT to the destination server as it arrives, so the memory
+used by the service does not grow with the size of the file. Large files are
+uploaded with the contents API's chunk protocol, and directories are copied
+file by file.
+"""
+import asyncio
+import base64
+from collections import deque
+import json
+import os
+import posixpath
+import tempfile
+from urllib.parse import urlencode
+
+from jupyterhub.utils import url_path_join
+
+from .clients import fetch
+from . import metrics
+from tornado import web
+from tornado.httpclient import HTTPRequest
+from tornado.log import app_log
+
+
+class ContentPipe():
+    """
+    A one-way byte pipe from a synchronous writer to an asynchronous reader.
+
+    Tornado does not apply backpressure to a streaming_callback, so the writer
+    cannot be made to wait. Instead, at most max_buffer_size bytes are held in
+    memory and anything beyond that spills to a temporary file until the
+    reader catches up.
+    """
+
+    def __init__(self, max_buffer_size, read_size=65536):
+        self.max_buffer_size = max_buffer_size
+        self.read_size = read_size
+        self._chunks = deque()
+        self._buffered = 0
+        self._spool = None
+        self._spool_read = 0
+        self._spool_write = 0
+        self._closed = False
+        self._error = None
+        self._readable = asyncio.Event()
+        self.bytes_written = 0
+
+    def write(self, chunk):
+        if self._error is not None:
+            # The reader has gone away; drop whatever is still arriving.
+            return
+        if self._closed:
+            raise RuntimeError("write to a closed ContentPipe")
+        self.bytes_written += len(chunk)
+        spooling = self._spool_write > self._spool_read
+        if spooling or self._buffered + len(chunk) > self.max_buffer_size:
+            if self._spool is None:
+                self._spool = tempfile.TemporaryFile()
+            self._spool.seek(self._spool_write)
+            self._spool.write(chunk)
+            self._spool_write += len(chunk)
+        else:
+            self._chunks.append(chunk)
+            self._buffered += len(chunk)
+        self._readable.set()
+
+    def close(self):
+        "Signal the end of the stream to the reader."
+        self._closed = True
+        self._readable.set()
+
+    def abort(self, error):
+        "Make the reader raise error, discarding anything still buffered."
+        self._error = error
+        self._closed = True
+        self._chunks.clear()
+        self._buffered = 0
+        self._discard_spool()
+        self._spool_read = self._spool_write = 0
+        self._readable.set()
+
+    async def read(self):
+        "Return the next chunk of bytes, or b'' at the end of the stream."
+        while True:
+            if self._error is not None:
+                raise self._error
+            if self._chunks:
+                chunk = self._chunks.popleft()
+                self._buffered -= len(chunk)
+                return chunk
+            if self._spool_write > self._spool_read:
+                self._spool.seek(self._spool_read)
+                chunk = self._spool.read(self.read_size)
+                self._spool_read += len(chunk)
+                if self._spool_read == self._spool_write:
+                    # Caught up; reuse the file from the start.
+                    self._spool.seek(0)
+                    self._spool.truncate()
+                    self._spool_read = self._spool_write = 0
+                return chunk
+            if self._closed:
+                self._discard_spool()
+                return b''
+            self._readable.clear()
+            await self._readable.wait()
+
+    def _discard_spool(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+
+class ContentTransfer():
+    """
+    Copy files between Jupyter servers.
+
+    Request timeouts scale with the size of the file: a transfer is given
+    base_timeout seconds plus enough time to move it at min_transfer_rate.
+    """
+
+    max_buffer_size = int(os.getenv(
+        'JUPYTERHUB_SHARE_LINK_TRANSFER_BUFFER_SIZE', 8 * 1024 * 1024))
+    base_timeout = float(os.getenv(
+        'JUPYTERHUB_SHARE_LINK_TRANSFER_TIMEOUT', 20))
+    max_timeout = float(os.getenv(
+        'JUPYTERHUB_SHARE_LINK_TRANSFER_MAX_TIMEOUT', 3600))
+    min_transfer_rate = float(os.getenv(
+        'JUPYTERHUB_SHARE_LINK_TRANSFER_MIN_RATE', 1024 * 1024))
+    # Contents API models wrap the file in JSON (and base64 for binary
+    # files), so the bytes on the wire exceed the size of the file itself.
+    wire_overhead = 2
+
+    # Larger files are uploaded in pieces, because Jupyter servers and the
+    # proxies in front of them limit the size of a request body.
+    chunk_threshold = int(os.getenv(
+        'JUPYTERHUB_SHARE_LINK_CHUNK_THRESHOLD', 16 * 1024 * 1024))
+    chunk_size = int(os.getenv(
+        'JUPYTERHUB_SHARE_LINK_CHUNK_SIZE', 8 * 1024 * 1024))
+
+    # Limits on copying a directory: how many files at once, and how many
+    # bytes in all.
+    tree_concurrency = int(os.getenv(
+        'JUPYTERHUB_SHARE_LINK_TREE_CONCURRENCY', 8))
+    tree_max_bytes = int(os.getenv(
+        'JUPYTERHUB_SHARE_LINK_TREE_MAX_BYTES', 1024 ** 3))
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def timeout_for(self, size):
+        "Return the request timeout, in seconds, for a file of size bytes."
+        if size is None:
+            return self.max_timeout
+        transfer_time = self.wire_overhead * size / self.min_transfer_rate
+        return min(self.base_timeout + transfer_time, self.max_timeout)
+
+    async def stat(self, url):
+        "Return the contents API model for url without its content."
+        req = HTTPRequest(f'{url}?{urlencode({"content": 0})}',
+                          headers=self.headers,
+                          request_timeout=self.base_timeout)
+        resp = await fetch(req)
+        return json.loads(resp.body.decode('utf-8'))
+
+    async def copy(self, source_server_url, source_path,
+                   dest_server_url, dest_path, progress=None):
+        """
+        Copy source_path on one server to dest_path on another.
+
+        Files larger than chunk_threshold are uploaded with the contents API
+        chunk protocol, so that no single request exceeds chunk_size bytes of
+        file content. Everything else is streamed in one PUT. Directories are
+        copied recursively, reporting to progress; see copy_tree.
+        """
+        source_url = url_path_join(source_server_url, 'api/contents',
+                                   source_path)
+        model = await self.stat(source_url)
+        if model['type'] == 'directory':
+            return await self.copy_tree(source_server_url, source_path,
+                                        dest_server_url, dest_path,
+                                        progress=progress)
+        return await self._copy_file(source_server_url, source_path,
+                                     dest_server_url, dest_path, model)
+
+    async def _copy_file(self, source_server_url, source_path,
+                         dest_server_url, dest_path, model):
+        "Copy a file, given its contents API model without content."
+        source_url = url_path_join(source_server_url, 'api/contents',
+                                   source_path)
+        dest_url = url_path_join(dest_server_url, 'api/contents', dest_path)
+        size = model.get('size')
+        large = size is not None and size > self.chunk_threshold
+        if model['type'] == 'file' and large:
+            files_url = url_path_join(source_server_url, 'files', source_path)
+            return await self._copy_chunked(files_url, dest_url, dest_path,
+                                            size)
+        return await self._copy_streamed(source_url, dest_url, size)
+
+    async def list_tree(self, source_server_url, source_path):
+        """
+        Return the directories and files under source_path.
+
+        Directories are listed parents first, as paths relative to
+        source_path; files as (relative path, model) pairs. Raise
+        HTTPError(413) as soon as the files add up to more than
+        tree_max_bytes.
+        """
+        directories = []
+        files = []
+        total = 0
+
+        async def walk(relative):
+            nonlocal total
+            url = url_path_join(source_server_url, 'api/contents',
+                                source_path, relative)
+            req = HTTPRequest(url, headers=self.headers,
+                              request_timeout=self.base_timeout)
+            listing = json.loads((await fetch(req)).body.decode('utf-8'))
+            for child in listing['content']:
+                child_relative = posixpath.join(relative, child['name'])
+                if child['type'] == 'directory':
+                    directories.append(child_relative)
+                    await walk(child_relative)
+                    continue
+                files.append((child_relative, child))
+                total += child.get('size') or 0
+                if total > self.tree_max_bytes:
+                    raise web.HTTPError(
+                        413, f"{source_path} holds more than "
+                             f"{self.tree_max_bytes} bytes, the most that "
+                             f"can be shared at once.")
+
+        await walk('')
+        return directories, files
+
+    async def copy_tree(self, source_server_url, source_path,
+                        dest_server_url, dest_path, progress=None):
+        """
+        Copy the directory source_path, and everything in it, to dest_path.
+
+        The whole tree is listed first, so that one over the size budget is
+        refused before anything is copied. Then the directories are created
+        and up to tree_concurrency files are copied at a time.
+        progress(files_done, files_total, bytes_done, bytes_total) is called
+        after each file, if given.
+        """
+        directories, files = await self.list_tree(source_server_url,
+                                                  source_path)
+        for relative in [''] + directories:
+            path = posixpath.join(dest_path, relative).rstrip('/')
+            req = HTTPRequest(
+                url_path_join(dest_server_url, 'api/contents', path), 'PUT',
+                headers=self.headers, body=json.dumps({'type': 'directory'}),
+                request_timeout=self.base_timeout)
+            await fetch(req)
+
+        files_total = len(files)
+        bytes_total = sum(model.get('size') or 0 for _, model in files)
+        done = {'files': 0, 'bytes': 0}
+        limit = asyncio.Semaphore(self.tree_concurrency)
+
+        async def copy_one(relative, model):
+            async with limit:
+                await self._copy_file(
+                    source_server_url, posixpath.join(source_path, relative),
+                    dest_server_url, posixpath.join(dest_path, relative),
+                    model)
+            done['files'] += 1
+            done['bytes'] += model.get('size') or 0
+            if progress is not None:
+                progress(done['files'], files_total, done['bytes'],
+                         bytes_total)
+
+        tasks = [asyncio.ensure_future(copy_one(relative, model))
+                 for relative, model in files]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        app_log.info("Copied %d files (%d bytes) from %s to %s",
+                     files_total, bytes_total, source_path, dest_path)
+
+    def _start_source(self, url, pipe, timeout):
+        "Start streaming url into pipe, and return the pending fetch."
+        async def fetch_source():
+            req = HTTPRequest(url, headers=self.headers,
+                              streaming_callback=pipe.write,
+                              request_timeout=timeout)
+            try:
+                with metrics.CONTENT_FETCH_DURATION.time():
+                    await fetch(req)
+            except BaseException as e:
+                pipe.abort(e)
+                raise
+            pipe.close()
+
+        return asyncio.ensure_future(fetch_source())
+
+    async def _finish(self, source, upload):
+        """
+        Await upload and then source, reporting the source's error if the
+        upload failed because the source did.
+        """
+        try:
+            with metrics.CONTENT_PUT_DURATION.time():
+                result = await upload
+        except BaseException:
+            if source.done():
+                # Report why the source failed, which is the root cause.
+                source.result()
+            else:
+                source.cancel()
+            raise
+        await source
+        return result
+
+    async def _copy_streamed(self, source_url, dest_url, size):
+        "Stream the contents model at source_url into dest_url."
+        timeout = self.timeout_for(size)
+        pipe = ContentPipe(self.max_buffer_size)
+
+        async def body_producer(write):
+            while True:
+                chunk = await pipe.read()
+                if not chunk:
+                    break
+                await write(chunk)
+
+        put = HTTPRequest(dest_url, 'PUT', headers=self.headers,
+                          body_producer=body_producer,
+                          request_timeout=timeout)
+        source = self._start_source(source_url, pipe, timeout)
+        resp = await self._finish(source, fetch(put))
+        app_log.debug("Copied %d bytes from %s to %s",
+                      pipe.bytes_written, source_url, dest_url)
+        return resp
+
+    async def _copy_chunked(self, files_url, dest_url, dest_path, size):
+        "Stream the raw file at files_url into dest_url in numbered chunks."
+        pipe = ContentPipe(self.max_buffer_size)
+        source = self._start_source(files_url, pipe, self.timeout_for(size))
+        resp = await self._finish(
+            source, self._upload_chunks(pipe, dest_url, dest_path))
+        app_log.debug("Copied %d bytes from %s to %s in chunks",
+                      pipe.bytes_written, files_url, dest_url)
+        return resp
+
+    async def _upload_chunks(self, reader, dest_url, dest_path):
+        """
+        Upload the bytes from reader.read() into dest_url in numbered chunks.
+
+        The contents API numbers chunks from 1 and marks the last one -1.
+        """
+        chunk_timeout = self.timeout_for(self.chunk_size)
+
+        async def put_chunk(number, data):
+            model = {'name': posixpath.basename(dest_path),
+                     'path': dest_path,
+                     'type': 'file',
+                     'format': 'base64',
+                     'chunk': number,
+                     'content': base64.b64encode(data).decode('ascii')}
+            req = HTTPRequest(dest_url, 'PUT', headers=self.headers,
+                              body=json.dumps(model),
+                              request_timeout=chunk_timeout)
+            return await fetch(req)
+
+        buffer = bytearray()
+        number = 1
+        while True:
+            data = await reader.read()
+            if not data:
+                break
+            buffer += data
+            # Hold back the last chunk_size bytes until we know whether
+            # more follow, because the final chunk must be marked -1.
+            while len(buffer) > self.chunk_size:
+                await put_chunk(number, bytes(buffer[:self.chunk_size]))
+                del buffer[:self.chunk_size]
+                number += 1
+        if number == 1:
+            # Chunk 1 is what truncates any existing file.
+            await put_chunk(number, bytes(buffer))
+            buffer.clear()
+        return await put_chunk(-1, bytes(buffer))
+
+    async def download(self, source_server_url, source_path, write):
+        """
+        Stream the raw bytes of the file at source_path into write().
+
+        Return its contents API model, without content.
+        """
+        source_url = url_path_join(source_server_url, 'api/contents',
+                                   source_path)
+        model = await self.stat(source_url)
+        if model['type'] == 'directory':
+            raise ValueError(f"{source_path} is a directory")
+        req = HTTPRequest(
+            url_path_join(source_server_url, 'files', source_path),
+            headers=self.headers,
+            streaming_callback=write,
+            request_timeout=self.timeout_for(model.get('size')))
+        with metrics.CONTENT_FETCH_DURATION.time():
+            await fetch(req)
+        return model
+
+    async def upload_file(self, file, size, dest_server_url, dest_path):
+        """
+        Upload the bytes of a local binary file object to dest_path.
+        """
+        dest_url = url_path_join(dest_server_url, 'api/contents', dest_path)
+        with metrics.CONTENT_PUT_DURATION.time():
+            if size > self.chunk_threshold:
+                return await self._upload_chunks(
+                    FileReader(file, self.chunk_size), dest_url, dest_path)
+            return await self._put_file(file, size, dest_url, dest_path)
+
+    async def _put_file(self, file, size, dest_url, dest_path):
+        model = {'name': posixpath.basename(dest_path),
+                 'path': dest_path,
+                 'type': 'file',
+                 'format': 'base64',
+                 'content': base64.b64encode(file.read()).decode('ascii')}
+        req = HTTPRequest(dest_url, 'PUT', headers=self.headers,
+                          body=json.dumps(model),
+                          request_timeout=self.timeout_for(size))
+        return await fetch(req)
+
+
+class FileReader():
+    "Read a local file with the same interface as ContentPipe.read."
+
+    def __init__(self, file, read_size):
+        self.file = file
+        self.read_size = read_size
+
+    async def read(self):
+        return self.file.read(self.read_size)